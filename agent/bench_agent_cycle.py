@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+bench_agent_cycle.py
+- Runs the agent's run_cycle() against fake_zabbix_server.py (in a subprocess) for growing fleets
+- Reports cycle wall time, JSON-RPC calls per cycle by method, agent CPU time and RSS
+- The first cycle is cold (full discovery), the following ones are steady state
+- Metrics/events are posted to a local sink that accepts everything, so encoding and HTTP cost count
+
+Usage: python bench_agent_cycle.py [--sizes 10,100,500] [--interfaces 24] [--cycles 3] [--latency-ms 2]
+"""
+
+import os
+import io
+import sys
+import time
+import json
+import socket
+import argparse
+import contextlib
+import subprocess
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def rss_mb() -> float:
+    """Current resident set size (Linux /proc), else peak RSS from getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+    return 0.0
+
+def start_sink() -> ThreadingHTTPServer:
+    """Stand-in backend that drains and accepts every POST"""
+    class Sink(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            body = b'{"inserted": 0}'
+            self.send_response(201)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Sink)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def rpc(url: str, method: str) -> dict:
+    r = requests.post(url, json={"jsonrpc": "2.0", "method": method, "params": {}, "id": 1}, timeout=10)
+    return r.json().get("result", {})
+
+def wait_for(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            rpc(url, "apiinfo.version")
+            return
+        except Exception:
+            time.sleep(0.1)
+    raise RuntimeError(f"fake Zabbix server did not come up at {url}")
+
+def bench_size(A, hosts: int, args) -> list:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/api_jsonrpc.php"
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_zabbix_server.py"),
+                               "--port", str(port), "--hosts", str(hosts), "--interfaces", str(args.interfaces),
+                               "--latency-ms", str(args.latency_ms), "--poll", str(args.poll)],
+                              stdout=subprocess.DEVNULL)
+    rows = []
+    try:
+        wait_for(url)
+        A.ZABBIX_URL = url
+        cache, discovery = {}, A.DiscoveryCache()
+        sender = A.BackendSender(spool=None)
+        sender.start()
+        for cycle in range(args.cycles):
+            if cycle:
+                # Let the fake fleet advance one poll so counters move like in production
+                time.sleep(args.pause)
+            rpc(url, "fake.reset")
+            cpu0, wall0 = time.process_time(), time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                A.run_cycle(cache, discovery, sender)
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+            calls = rpc(url, "fake.reset")
+            last = A.STATS.last_cycle or {}
+            rows.append({
+                "hosts": hosts, "cycle": "cold" if cycle == 0 else f"warm{cycle}",
+                "wall_s": round(wall, 3), "cpu_s": round(cpu, 3), "rss_mb": round(rss_mb(), 1),
+                "api_calls": sum(calls.values()), "calls": calls,
+                "metrics": last.get("metrics"), "events": last.get("events"),
+                "bytes_sent": last.get("bytes_sent"), "bytes_received": last.get("bytes_received")
+            })
+        sender.stop()
+    finally:
+        server.terminate()
+        server.wait()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent cycle benchmark against a fake Zabbix fleet")
+    parser.add_argument("--sizes", default="10,100,500", help="comma-separated host counts")
+    parser.add_argument("--interfaces", type=int, default=24)
+    parser.add_argument("--cycles", type=int, default=3, help="cycles per size (first one is cold)")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="fake API latency per call")
+    parser.add_argument("--poll", type=int, default=2, help="fake item update period in seconds")
+    parser.add_argument("--pause", type=float, default=2.0, help="seconds between cycles")
+    parser.add_argument("--force-wait", action="store_true",
+                        help="keep the agent's FORCE_UPDATE_WAIT_SECONDS wait after task.create (skipped by default)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # Configure the agent before import: no spool, cache or stats files, sink backend
+    sink = start_sink()
+    backend = f"http://127.0.0.1:{sink.server_address[1]}"
+    os.environ.update({"ZABBIX_API_TOKEN": "bench", "BACKEND_URL": backend, "SPOOL_DIR": "",
+                       "AGENT_STATS_FILE": "", "POLL_INTERVAL": str(args.poll)})
+    if not args.force_wait:
+        os.environ["FORCE_UPDATE_WAIT_SECONDS"] = "0"
+    import zabbix_network_agent_with_ingest as A
+
+    print(f"Agent cycle benchmark: sizes={args.sizes} interfaces={args.interfaces} "
+          f"latency={args.latency_ms}ms concurrency={A.ZABBIX_MAX_CONCURRENCY} "
+          f"force-wait={'on' if args.force_wait else 'off'}")
+    print(f"{'hosts':>6} {'cycle':>6} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'calls':>6} "
+          f"{'metrics':>8} {'events':>7}  calls by method")
+    results = []
+    for hosts in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        for row in bench_size(A, hosts, args):
+            results.append(row)
+            by_method = " ".join(f"{m}={n}" for m, n in sorted(row["calls"].items()))
+            print(f"{row['hosts']:>6} {row['cycle']:>6} {row['wall_s']:>8.2f} {row['cpu_s']:>8.2f} "
+                  f"{row['rss_mb']:>8.1f} {row['api_calls']:>6} {row['metrics'] or 0:>8} {row['events'] or 0:>7}  {by_method}")
+    sink.shutdown()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+fake_zabbix_server.py
+- Local stand-in for the Zabbix JSON-RPC API, for benchmarking the agent without a real server
+- Implements apiinfo.version, host.get, item.get (hostids/itemids/search/filter/limit/sortfield),
+  history.get and task.create, plus fake.stats / fake.reset for per-method call counts
+- Generates a fleet of N hosts x M interfaces with in/out octet counters, oper status and ifDescr
+  items; a share of interfaces use 32-bit counters that wrap, a share of items is stale
+
+Usage: python fake_zabbix_server.py --hosts 200 --interfaces 48 --port 8089 --latency-ms 5
+Then:  ZABBIX_URL=http://127.0.0.1:8089/api_jsonrpc.php python zabbix_network_agent_with_ingest.py
+"""
+
+import sys
+import time
+import json
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+
+API_VERSION = "6.0.25"
+COUNTER_32 = 2 ** 32
+COUNTER_64 = 2 ** 64
+
+class Fleet:
+    """Deterministic synthetic fleet; item values are a function of the poll clock"""
+
+    def __init__(self, hosts: int = 50, interfaces: int = 24, system_items: int = 6, poll: int = 30,
+                 wrap_ratio: float = 0.1, stale_ratio: float = 0.05, down_ratio: float = 0.1, seed: int = 1):
+        rnd = random.Random(seed)
+        self.poll = poll
+        self.started = int(time.time())
+        self.hosts: List[dict] = []
+        self.items: Dict[str, dict] = {}
+        self.items_by_host: Dict[str, List[dict]] = {}
+        # per-item generator parameters: (base, rate per second, modulus, stale)
+        self.gen: Dict[str, tuple] = {}
+        itemid = 100000
+
+        for h in range(hosts):
+            hostid = str(10100 + h)
+            office = h % 10
+            self.hosts.append({
+                "hostid": hostid,
+                "host": f"sw-{h:05d}",
+                "name": f"Switch {h:05d}",
+                "status": "0",
+                "inventory": {
+                    "type": "switch", "type_full": "Access switch",
+                    "location": f"Office {office}",
+                    "location_lat": f"{19.0 + office / 10:.4f}", "location_lon": f"{72.8 + office / 10:.4f}",
+                    "asset_tag": f"AT{h:05d}"
+                },
+                "interfaces": [{"interfaceid": str(h + 1), "ip": f"10.{h // 65536 % 256}.{h // 256 % 256}.{h % 256}",
+                                "type": "2", "dns": ""}],
+                "parentTemplates": [{"templateid": "10226"}]
+            })
+            host_items = []
+
+            def add(name: str, key: str, value_type: str, gen: tuple, units: str = ""):
+                nonlocal itemid
+                itemid += 1
+                item = {
+                    "itemid": str(itemid), "hostid": hostid, "name": name, "key_": key,
+                    "value_type": value_type, "units": units, "status": "0", "state": "0",
+                    "error": "", "templateid": "0"
+                }
+                self.items[item["itemid"]] = item
+                self.gen[item["itemid"]] = gen
+                host_items.append(item)
+
+            for i in range(1, interfaces + 1):
+                stale = rnd.random() < stale_ratio
+                wraps = rnd.random() < wrap_ratio
+                modulus = COUNTER_32 if wraps else COUNTER_64
+                # 32-bit counters run fast enough to wrap every few minutes
+                rate = rnd.uniform(5e6, 3e7) if wraps else rnd.uniform(1e3, 5e6)
+                prefix = "if" if wraps else "ifHC"
+                add(f"Interface Gi0/{i}: Bits received", f"{prefix}InOctets[{i}]", "3",
+                    (rnd.randrange(modulus), rate, modulus, stale), "bps")
+                add(f"Interface Gi0/{i}: Bits sent", f"{prefix}OutOctets[{i}]", "3",
+                    (rnd.randrange(modulus), rate / 2, modulus, stale), "bps")
+                add(f"Interface Gi0/{i}: Operational status", f"ifOperStatus[{i}]", "3",
+                    ("2" if rnd.random() < down_ratio else "1", 0, None, stale))
+                add(f"Interface Gi0/{i}: ifDescr", f"ifDescr[{i}]", "1", (f"GigabitEthernet0/{i}", 0, None, False))
+            system = [("CPU utilization", "system.cpu.util", "0", "%"),
+                      ("Memory utilization", "vm.memory.util", "0", "%"),
+                      ("System uptime", "system.uptime", "3", "uptime"),
+                      ("Fan status", "sensor.fan.status", "3", ""),
+                      ("Power supply status", "sensor.psu.status", "3", ""),
+                      ("Temperature", "sensor.temp.value", "0", "C")]
+            for name, key, value_type, units in system[:system_items]:
+                add(name, key, value_type, (rnd.uniform(1, 90), 0, None, rnd.random() < stale_ratio), units)
+
+            host_items.sort(key=lambda it: it["name"])
+            self.items_by_host[hostid] = host_items
+
+    def clock(self, itemid: str, now: Optional[int] = None) -> int:
+        """Clock of the newest sample: the last poll boundary, frozen for stale items"""
+        now = int(now or time.time())
+        _, _, _, stale = self.gen[itemid]
+        if stale:
+            return self.started - 3600
+        return now - now % self.poll
+
+    def value(self, itemid: str, clock: int) -> str:
+        base, rate, modulus, _ = self.gen[itemid]
+        if modulus is None:
+            if isinstance(base, str):
+                return base
+            return f"{base:.4f}" if self.items[itemid]["value_type"] == "0" else str(int(base))
+        return str(int(base + rate * clock) % modulus)
+
+    def with_values(self, item: dict) -> dict:
+        clock = self.clock(item["itemid"])
+        out = dict(item)
+        out["lastclock"] = str(clock)
+        out["lastvalue"] = self.value(item["itemid"], clock)
+        return out
+
+class FakeZabbixAPI:
+    def __init__(self, fleet: Fleet, latency_ms: float = 0.0):
+        self.fleet = fleet
+        self.latency = latency_ms / 1000.0
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def handle(self, method: str, params: dict) -> Any:
+        if not str(method).startswith("fake."):
+            with self.lock:
+                self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        handler = {
+            "apiinfo.version": lambda p: API_VERSION,
+            "host.get": self.host_get,
+            "item.get": self.item_get,
+            "history.get": self.history_get,
+            "task.create": self.task_create,
+            "fake.stats": lambda p: dict(self.calls),
+            "fake.reset": self.reset
+        }.get(method)
+        if handler is None:
+            raise KeyError(method)
+        return handler(params or {})
+
+    def reset(self, params: dict) -> dict:
+        with self.lock:
+            calls, self.calls = self.calls, {}
+        return calls
+
+    @staticmethod
+    def _ids(value) -> Optional[set]:
+        if value is None:
+            return None
+        return {str(v) for v in (value if isinstance(value, list) else [value])}
+
+    @staticmethod
+    def _matches_filter(obj: dict, flt: dict) -> bool:
+        for field, wanted in (flt or {}).items():
+            wanted = wanted if isinstance(wanted, list) else [wanted]
+            if str(obj.get(field)) not in {str(w) for w in wanted}:
+                return False
+        return True
+
+    @staticmethod
+    def _output(obj: dict, output) -> dict:
+        if output in (None, "extend"):
+            return dict(obj)
+        return {k: obj[k] for k in output if k in obj}
+
+    def host_get(self, params: dict) -> List[dict]:
+        hostids = self._ids(params.get("hostids"))
+        out = []
+        for h in self.fleet.hosts:
+            if hostids is not None and h["hostid"] not in hostids:
+                continue
+            if not self._matches_filter(h, params.get("filter")):
+                continue
+            row = self._output({k: h[k] for k in ("hostid", "host", "name", "status")}, params.get("output"))
+            if "selectInventory" in params:
+                row["inventory"] = self._output(h["inventory"], params["selectInventory"])
+            if "selectInterfaces" in params:
+                row["interfaces"] = [self._output(i, params["selectInterfaces"]) for i in h["interfaces"]]
+            if params.get("selectItems") == "count":
+                row["items"] = str(len(self.fleet.items_by_host.get(h["hostid"], [])))
+            if "selectParentTemplates" in params:
+                row["parentTemplates"] = [self._output(t, params["selectParentTemplates"]) for t in h["parentTemplates"]]
+            out.append(row)
+        return out[:int(params["limit"])] if "limit" in params else out
+
+    def item_get(self, params: dict) -> List[dict]:
+        itemids = self._ids(params.get("itemids"))
+        hostids = self._ids(params.get("hostids"))
+        if itemids is not None:
+            candidates = [self.fleet.items[i] for i in sorted(itemids) if i in self.fleet.items]
+        elif hostids is not None:
+            candidates = [it for hid in hostids for it in self.fleet.items_by_host.get(hid, [])]
+        else:
+            candidates = list(self.fleet.items.values())
+        if hostids is not None and itemids is not None:
+            candidates = [it for it in candidates if it["hostid"] in hostids]
+        search = {k: str(v).lower() for k, v in (params.get("search") or {}).items()}
+        out = []
+        for it in candidates:
+            if not self._matches_filter(it, params.get("filter")):
+                continue
+            if search and not all(term in str(it.get(field, "")).lower() for field, term in search.items()):
+                continue
+            out.append(self._output(self.fleet.with_values(it), params.get("output")))
+        if params.get("sortfield") == "name":
+            out.sort(key=lambda it: it.get("name", ""))
+        return out[:int(params["limit"])] if "limit" in params else out
+
+    def history_get(self, params: dict) -> List[dict]:
+        history = int(params.get("history", 3))
+        time_from = int(params.get("time_from", 0))
+        rows = []
+        for itemid in sorted(self._ids(params.get("itemids")) or []):
+            item = self.fleet.items.get(itemid)
+            if item is None or int(item["value_type"]) != history:
+                continue
+            newest = self.fleet.clock(itemid)
+            for clock in (newest, newest - self.fleet.poll):
+                if clock >= time_from:
+                    rows.append({"itemid": itemid, "clock": str(clock), "value": self.fleet.value(itemid, clock),
+                                 "ns": "0"})
+        rows.sort(key=lambda r: int(r["clock"]), reverse=params.get("sortorder") == "DESC")
+        rows = [self._output(r, params.get("output")) for r in rows]
+        return rows[:int(params["limit"])] if "limit" in params else rows
+
+    def task_create(self, params: dict) -> dict:
+        return {"taskids": [str(random.randint(1, 10 ** 6))]}
+
+def make_handler(api: FakeZabbixAPI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                req = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._reply({"jsonrpc": "2.0", "error": {"code": -32700, "message": "Parse error"}, "id": None})
+            try:
+                result = api.handle(req.get("method"), req.get("params"))
+                resp = {"jsonrpc": "2.0", "result": result, "id": req.get("id")}
+            except KeyError:
+                resp = {"jsonrpc": "2.0", "id": req.get("id"),
+                        "error": {"code": -32601, "message": "Method not found.", "data": str(req.get("method"))}}
+            self._reply(resp)
+
+        def _reply(self, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def serve(fleet: Fleet, port: int = 8089, latency_ms: float = 0.0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Start the fake API on a background thread and return the server (port 0 picks a free port)"""
+    server = ThreadingHTTPServer((host, port), make_handler(FakeZabbixAPI(fleet, latency_ms)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-zabbix", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Zabbix JSON-RPC API with a synthetic fleet")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--bind", default="127.0.0.1")
+    parser.add_argument("--hosts", type=int, default=50)
+    parser.add_argument("--interfaces", type=int, default=24)
+    parser.add_argument("--system-items", type=int, default=6)
+    parser.add_argument("--poll", type=int, default=30, help="seconds between simulated item updates")
+    parser.add_argument("--wrap-ratio", type=float, default=0.1, help="share of interfaces with wrapping 32-bit counters")
+    parser.add_argument("--stale-ratio", type=float, default=0.05, help="share of items that never update")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per API call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fleet = Fleet(args.hosts, args.interfaces, args.system_items, args.poll,
+                  args.wrap_ratio, args.stale_ratio, seed=args.seed)
+    server = serve(fleet, args.port, args.latency_ms, args.bind)
+    print(f"Fake Zabbix API on http://{args.bind}:{server.server_address[1]}/api_jsonrpc.php "
+          f"({len(fleet.hosts)} hosts, {len(fleet.items)} items, {args.latency_ms} ms latency)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
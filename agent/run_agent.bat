@@ -10,6 +10,7 @@ set ZABBIX_URL=http://192.168.0.134/zabbix/api_jsonrpc.php
 set BACKEND_URL=http://localhost:3000
 set POLL_INTERVAL=30
 set ALL_ITEMS=false
+set ZABBIX_MAX_CONCURRENCY=8
 
 echo Starting Zabbix Network Agent...
 echo ZABBIX_API_TOKEN: %ZABBIX_API_TOKEN%
@@ -17,6 +18,7 @@ echo ZABBIX_URL: %ZABBIX_URL%
 echo BACKEND_URL: %BACKEND_URL%
 echo POLL_INTERVAL: %POLL_INTERVAL%
 echo ALL_ITEMS: %ALL_ITEMS%
+echo ZABBIX_MAX_CONCURRENCY: %ZABBIX_MAX_CONCURRENCY%
 echo.
 
 python zabbix_network_agent_with_ingest.py
@@ -11,8 +11,26 @@ import sys
 import time
 import json
 import re
+import gzip
+import queue
+import bisect
+import socket
+import hashlib
+import signal
+import subprocess
+import threading
+import contextlib
 import requests
-from typing import Optional, Dict, Any, List
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+try:
+    import msgpack  # optional, binary encoding for the compact wire format
+except ImportError:
+    msgpack = None
 
 # ------------- CONFIG -------------
 ZABBIX_URL = os.environ.get("ZABBIX_URL", "http://192.168.0.134/zabbix/api_jsonrpc.php")
@@ -28,6 +46,75 @@ GEOIP_URL = "http://ip-api.com/json/"
 # Environment variable to control whether to collect all items or just network items
 ALL_ITEMS = os.environ.get("ALL_ITEMS", "false").lower() == "true"
 
+# history.get look-back window used by the batched rate lookup
+HISTORY_WINDOW_SECONDS = int(os.environ.get("HISTORY_WINDOW_SECONDS", str(max(600, POLL_INTERVAL * 10))))
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "500"))
+
+# Largest gap between two cached counter samples that is still turned into a local rate;
+# beyond it (or on a cold start) the rate falls back to history.get
+RATE_MAX_GAP_SECONDS = int(os.environ.get("RATE_MAX_GAP_SECONDS", str(HISTORY_WINDOW_SECONDS)))
+
+# How often hosts and the item catalog are rebuilt from scratch; between rebuilds only
+# hosts whose item count or linked templates changed are re-read
+DISCOVERY_REFRESH_SECONDS = int(os.environ.get("DISCOVERY_REFRESH_SECONDS", "3600"))
+# Number of itemids per item.get when refreshing values of known items
+ITEM_VALUE_CHUNK = max(1, int(os.environ.get("ITEM_VALUE_CHUNK", "1000")))
+
+# Number of hostids per bulk item.get when building the fleet item catalog
+ITEM_CATALOG_HOST_CHUNK = max(1, int(os.environ.get("ITEM_CATALOG_HOST_CHUNK", "50")))
+ITEM_OUTPUT_FIELDS = ["itemid", "hostid", "name", "key_", "value_type", "units", "lastvalue", "lastclock", "status", "state", "error"]
+
+# Seconds to wait after task.create so Zabbix can process the forced item checks
+FORCE_UPDATE_WAIT_SECONDS = float(os.environ.get("FORCE_UPDATE_WAIT_SECONDS", "5"))
+
+# Events: "transitions" sends an event only when an interface/metric changes status or
+# severity (plus a heartbeat every EVENT_HEARTBEAT_SECONDS, 0 = none); "all" sends one per item per cycle
+EVENT_MODE = os.environ.get("EVENT_MODE", "transitions").lower()
+EVENT_HEARTBEAT_SECONDS = int(os.environ.get("EVENT_HEARTBEAT_SECONDS", "3600"))
+
+# Streaming delivery: documents per POST and number of pending chunks before collection blocks
+SEND_CHUNK_SIZE = max(1, int(os.environ.get("SEND_CHUNK_SIZE", "5000")))
+SEND_QUEUE_MAX = max(1, int(os.environ.get("SEND_QUEUE_MAX", "16")))
+
+# On-disk spool for batches the backend did not accept (empty SPOOL_DIR disables it)
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "ingest_spool")
+SPOOL_MAX_BYTES = int(os.environ.get("SPOOL_MAX_BYTES", str(512 * 1024 * 1024)))
+SPOOL_SEGMENT_BYTES = int(os.environ.get("SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+SPOOL_REPLAY_RATE = float(os.environ.get("SPOOL_REPLAY_RATE", "2"))  # replayed batches per second
+
+# Max hosts processed in parallel against the Zabbix server (1 = serial, legacy behaviour)
+ZABBIX_MAX_CONCURRENCY = max(1, int(os.environ.get("ZABBIX_MAX_CONCURRENCY", "8")))
+
+# Keep-alive connection pool sizes per endpoint
+ZABBIX_POOL_SIZE = int(os.environ.get("ZABBIX_POOL_SIZE", str(ZABBIX_MAX_CONCURRENCY)))
+BACKEND_POOL_SIZE = int(os.environ.get("BACKEND_POOL_SIZE", "4"))
+GEOIP_POOL_SIZE = int(os.environ.get("GEOIP_POOL_SIZE", "2"))
+
+# gzip request bodies sent to the backend /ingest/* endpoints (backend must accept Content-Encoding: gzip)
+BACKEND_GZIP = os.environ.get("BACKEND_GZIP", "false").lower() == "true"
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", "1024"))
+
+# Wire format for /ingest/metrics: "json" (list of metric documents) or "compact"
+# (per-host header + columnar arrays, msgpack when installed, always gzip-compressed)
+BACKEND_WIRE_FORMAT = os.environ.get("BACKEND_WIRE_FORMAT", "json").lower()
+
+# Self-instrumentation: Prometheus text endpoint (0 = disabled) and rolling JSON summary
+# of the last AGENT_STATS_HISTORY cycles (empty AGENT_STATS_FILE disables it)
+AGENT_METRICS_PORT = int(os.environ.get("AGENT_METRICS_PORT", "0"))
+AGENT_STATS_FILE = os.environ.get("AGENT_STATS_FILE", "agent_stats.json")
+AGENT_STATS_HISTORY = max(1, int(os.environ.get("AGENT_STATS_HISTORY", "60")))
+
+# Sharding: with SHARD_DIR set, every agent instance owns the hosts that a consistent-hash ring
+# of hostids assigns to it; instances announce themselves with heartbeat files in SHARD_DIR (a
+# shared directory when instances run on several nodes). SHARD_WORKERS > 0 makes this process
+# a supervisor that runs that many local worker processes instead of polling itself.
+SHARD_DIR = os.environ.get("SHARD_DIR", "")
+SHARD_ID = os.environ.get("SHARD_ID", f"{socket.gethostname()}-{os.getpid()}")
+SHARD_VNODES = max(1, int(os.environ.get("SHARD_VNODES", "64")))
+SHARD_HEARTBEAT_SECONDS = float(os.environ.get("SHARD_HEARTBEAT_SECONDS", "10"))
+SHARD_TTL_SECONDS = float(os.environ.get("SHARD_TTL_SECONDS", str(max(30.0, SHARD_HEARTBEAT_SECONDS * 3))))
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "0"))
+
 # Enhanced network and system item terms for better matching
 NETWORK_ITEM_TERMS = [
     "if", "traffic", "interface", "net", "bandwidth", "in", "out", "octets", "errors", "discard",
@@ -36,15 +123,303 @@ NETWORK_ITEM_TERMS = [
     "fa0", "gi0", "eth", "port", "link", "speed", "duplex", "status", "utilization"
 ]
 
+# ------------- pooled HTTP sessions -------------
+POOL_SIZES = {"zabbix": ZABBIX_POOL_SIZE, "backend": BACKEND_POOL_SIZE, "geoip": GEOIP_POOL_SIZE}
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+def get_session(endpoint: str) -> requests.Session:
+    """Shared keep-alive session for an endpoint ("zabbix", "backend", "geoip").
+
+    The underlying urllib3 pool is thread-safe, so the same session is used by
+    the serial path and by the host worker threads. Responses are requested
+    gzip/deflate compressed and decoded transparently by requests.
+    """
+    session = _sessions.get(endpoint)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(endpoint)
+        if session is None:
+            size = max(1, POOL_SIZES.get(endpoint, 4))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Accept-Encoding"] = "gzip, deflate"
+            _sessions[endpoint] = session
+    return session
+
+# ------------- self-instrumentation -------------
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class AgentStats:
+    """Per-cycle phase timings, per-method call stats, bytes and per-host volumes.
+
+    Counters and histograms are cumulative (Prometheus semantics); phases and
+    per-host numbers describe the last finished cycle. Phases entered from the
+    host worker threads are summed over those threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.latency: Dict[str, List[int]] = {}
+        self.latency_sum: Dict[str, float] = {}
+        self.bytes_sent: Dict[str, int] = {}
+        self.bytes_received: Dict[str, int] = {}
+        self.cycles = 0
+        self.overruns = 0
+        self.phases: Dict[str, float] = {}
+        self.hosts: Dict[str, dict] = {}
+        self.cycle_hosts: Dict[str, dict] = {}
+        self.last_cycle: Optional[dict] = None
+        self.history: List[dict] = []
+        self.cycle_start: Optional[float] = None
+        self.cycle_base: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def record_call(self, endpoint: str, method: str, seconds: float, ok: bool, sent: int = 0, received: int = 0):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if not ok:
+                self.errors[method] = self.errors.get(method, 0) + 1
+            buckets = self.latency.setdefault(method, [0] * (len(LATENCY_BUCKETS) + 1))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self.latency_sum[method] = self.latency_sum.get(method, 0.0) + seconds
+            self.bytes_sent[endpoint] = self.bytes_sent.get(endpoint, 0) + sent
+            self.bytes_received[endpoint] = self.bytes_received.get(endpoint, 0) + received
+
+    def record_host(self, host: str, items: int, metrics: int, events: int):
+        with self.lock:
+            self.cycle_hosts[host] = {"items": items, "metrics": metrics, "events": events}
+
+    def _totals(self) -> Dict[str, int]:
+        return {
+            "api_calls": sum(self.calls.values()),
+            "api_errors": sum(self.errors.values()),
+            "bytes_sent": sum(self.bytes_sent.values()),
+            "bytes_received": sum(self.bytes_received.values())
+        }
+
+    def begin_cycle(self):
+        with self.lock:
+            self.cycle_start = time.time()
+            self.phases = {}
+            self.cycle_hosts = {}
+            self.cycle_base = self._totals()
+
+    def end_cycle(self) -> dict:
+        with self.lock:
+            duration = time.time() - (self.cycle_start or time.time())
+            overrun = duration > POLL_INTERVAL
+            self.cycles += 1
+            self.overruns += int(overrun)
+            self.hosts = self.cycle_hosts
+            totals = self._totals()
+            summary = {
+                "started_at": int(self.cycle_start or 0),
+                "duration_seconds": round(duration, 3),
+                "overrun": overrun,
+                "phases": {k: round(v, 3) for k, v in self.phases.items()},
+                "hosts": len(self.hosts),
+                "items": sum(h["items"] for h in self.hosts.values()),
+                "metrics": sum(h["metrics"] for h in self.hosts.values()),
+                "events": sum(h["events"] for h in self.hosts.values())
+            }
+            summary.update({k: totals[k] - self.cycle_base.get(k, 0) for k in totals})
+            self.last_cycle = summary
+            self.history = (self.history + [summary])[-AGENT_STATS_HISTORY:]
+            return summary
+
+    def write_summary(self, path: str):
+        with self.lock:
+            doc = {
+                "cycles": self.cycles,
+                "overruns": self.overruns,
+                "last_cycle": self.last_cycle,
+                "hosts": dict(self.hosts),
+                "api": {m: {"calls": self.calls[m], "errors": self.errors.get(m, 0),
+                            "avg_seconds": round(self.latency_sum[m] / self.calls[m], 4)}
+                        for m in self.calls},
+                "history": list(self.history)
+            }
+        try:
+            tmp_file = path + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(doc, f, indent=1)
+            os.replace(tmp_file, path)
+        except Exception as e:
+            print("[STATS ERROR] failed to save summary:", e)
+
+    def prometheus(self) -> str:
+        def esc(v) -> str:
+            return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = []
+        with self.lock:
+            last = self.last_cycle or {}
+            lines += ["# TYPE agent_cycles_total counter", f"agent_cycles_total {self.cycles}",
+                      "# TYPE agent_cycle_overruns_total counter", f"agent_cycle_overruns_total {self.overruns}",
+                      "# TYPE agent_cycle_duration_seconds gauge",
+                      f"agent_cycle_duration_seconds {last.get('duration_seconds', 0)}",
+                      "# TYPE agent_phase_duration_seconds gauge"]
+            lines += [f'agent_phase_duration_seconds{{phase="{esc(k)}"}} {v}' for k, v in last.get("phases", {}).items()]
+            lines.append("# TYPE agent_api_calls_total counter")
+            lines += [f'agent_api_calls_total{{method="{esc(m)}"}} {n}' for m, n in self.calls.items()]
+            lines.append("# TYPE agent_api_errors_total counter")
+            lines += [f'agent_api_errors_total{{method="{esc(m)}"}} {self.errors.get(m, 0)}' for m in self.calls]
+            lines.append("# TYPE agent_api_latency_seconds histogram")
+            for m, buckets in self.latency.items():
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + ["+Inf"], buckets):
+                    cumulative += n
+                    lines.append(f'agent_api_latency_seconds_bucket{{method="{esc(m)}",le="{bound}"}} {cumulative}')
+                lines.append(f'agent_api_latency_seconds_sum{{method="{esc(m)}"}} {self.latency_sum[m]:.6f}')
+                lines.append(f'agent_api_latency_seconds_count{{method="{esc(m)}"}} {cumulative}')
+            lines.append("# TYPE agent_http_bytes_sent_total counter")
+            lines += [f'agent_http_bytes_sent_total{{endpoint="{e}"}} {n}' for e, n in self.bytes_sent.items()]
+            lines.append("# TYPE agent_http_bytes_received_total counter")
+            lines += [f'agent_http_bytes_received_total{{endpoint="{e}"}} {n}' for e, n in self.bytes_received.items()]
+            for field in ("items", "metrics", "events"):
+                lines.append(f"# TYPE agent_host_{field} gauge")
+                lines += [f'agent_host_{field}{{host="{esc(h)}"}} {v[field]}' for h, v in self.hosts.items()]
+        return "\n".join(lines) + "\n"
+
+STATS = AgentStats()
+
+def _response_size(r: requests.Response) -> int:
+    length = r.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else len(r.content)
+
+def start_metrics_server(port: int):
+    """Serve STATS.prometheus() on http://0.0.0.0:<port>/metrics from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = STATS.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="agent-metrics", daemon=True).start()
+    print(f"[STATS] Prometheus metrics on http://0.0.0.0:{port}/metrics")
+    return server
+
+def encode_json_body(payload, compress: bool = False) -> Tuple[bytes, Dict[str, str]]:
+    """Serialize a JSON payload, gzip-compressing it when asked and worthwhile"""
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if compress and len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+# ------------- compact metrics wire format -------------
+COMPACT_FORMAT = "compact-v1"
+COMPACT_CONTENT_TYPE_MSGPACK = "application/x-msgpack"
+COMPACT_CONTENT_TYPE_JSON = "application/vnd.netmon.compact+json"
+
+def _identical(a: Any, b: Any) -> bool:
+    """Equality that also compares types (1 == 1.0 == True), so collapsed values round-trip exactly"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_identical(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(_identical(x, y) for x, y in zip(a, b))
+    return a == b
+
+def _encode_column(values: List[Any]):
+    """Column as {"const": v}, {"dict": [...], "codes": [...]} or a plain list"""
+    first = values[0]
+    if all(_identical(v, first) for v in values):
+        return {"const": first}
+    if all(v is None or isinstance(v, str) for v in values):
+        distinct = list(dict.fromkeys(values))
+        if len(distinct) <= len(values) // 2:
+            codes = {v: i for i, v in enumerate(distinct)}
+            return {"dict": distinct, "codes": [codes[v] for v in values]}
+    return values
+
+def encode_compact_metrics(docs: List[dict]) -> dict:
+    """Group metric documents per device: shared meta once, everything else as columns"""
+    by_device: Dict[Any, List[dict]] = {}
+    for doc in docs:
+        by_device.setdefault((doc.get("meta") or {}).get("device_id"), []).append(doc)
+
+    hosts = []
+    for host_docs in by_device.values():
+        metas = [d.get("meta") or {} for d in host_docs]
+        meta_keys = list(dict.fromkeys(k for m in metas for k in m))
+        shared = {}
+        columns = {}
+        for k in meta_keys:
+            values = [m.get(k) for m in metas]
+            if all(k in m for m in metas) and all(_identical(v, values[0]) for v in values):
+                shared[k] = values[0]
+            else:
+                columns["meta." + k] = _encode_column(values)
+        field_keys = list(dict.fromkeys(k for d in host_docs for k in d if k != "meta"))
+        for k in field_keys:
+            columns[k] = _encode_column([d.get(k) for d in host_docs])
+        hosts.append({"meta": shared, "count": len(host_docs), "columns": columns})
+    return {"format": COMPACT_FORMAT, "hosts": hosts}
+
+def encode_ingest_body(payload, wire_format: str = "json") -> Tuple[bytes, Dict[str, str]]:
+    """Body and headers for an /ingest/* POST in the requested wire format"""
+    if wire_format != "compact":
+        return encode_json_body(payload, compress=BACKEND_GZIP)
+    batch = encode_compact_metrics(payload)
+    if msgpack is not None:
+        body = msgpack.packb(batch, use_bin_type=True)
+        headers = {"Content-Type": COMPACT_CONTENT_TYPE_MSGPACK}
+    else:
+        body = json.dumps(batch, separators=(",", ":")).encode("utf-8")
+        headers = {"Content-Type": COMPACT_CONTENT_TYPE_JSON}
+    if len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
 # ------------- JSON-RPC helper with better error handling -------------
 def api_call(method: str, params: dict = None, req_id: int = 1, timeout: int = 10) -> dict:
     payload = {"jsonrpc": "2.0", "method": method, "params": params or {}, "id": req_id}
+    body = json.dumps(payload)
+    start = time.perf_counter()
+    ok, received = False, 0
     try:
-        r = requests.post(ZABBIX_URL, headers=HEADERS, data=json.dumps(payload), timeout=timeout)
+        r = get_session("zabbix").post(ZABBIX_URL, headers=HEADERS, data=body, timeout=timeout)
+        received = _response_size(r)
         r.raise_for_status()
         result = r.json()
         if "error" in result:
             print(f"[API ERROR] {method}: {result['error']}")
+        else:
+            ok = True
         return result
     except requests.RequestException as e:
         print(f"[REQUEST ERROR] {method}: {e}")
@@ -52,26 +427,32 @@ def api_call(method: str, params: dict = None, req_id: int = 1, timeout: int = 1
     except ValueError as e:
         print(f"[JSON ERROR] {method}: {e}")
         return {"error": {"message": "Non-JSON response", "raw": r.text[:200]}}
+    finally:
+        STATS.record_call("zabbix", method, time.perf_counter() - start, ok, len(body), received)
 
 # ------------- Force item update function -------------
-def force_item_update(hostid: str, max_items: int = 50) -> bool:
+def force_item_update(hostid: str, max_items: int = 50, known_items: List[dict] = None) -> bool:
     """Force Zabbix to update items for a host by triggering item checks"""
     print(f"[FORCE UPDATE] Triggering item updates for host {hostid}")
     
-    # Get items that can be updated
-    params = {
-        "output": ["itemid", "key_", "name", "status", "state"],
-        "hostids": hostid,
-        "filter": {"status": 0},  # Only enabled items
-        "limit": max_items
-    }
-    
-    resp = api_call("item.get", params, req_id=601)
-    if "error" in resp or not resp.get("result"):
-        print("[FORCE UPDATE] Failed to get items for update")
-        return False
-    
-    items = resp["result"]
+    if known_items:
+        # Items already known from the catalog, no need to ask Zabbix again
+        items = [i for i in known_items if int(i.get("status", 1)) == 0][:max_items]
+    else:
+        # Get items that can be updated
+        params = {
+            "output": ["itemid", "key_", "name", "status", "state"],
+            "hostids": hostid,
+            "filter": {"status": 0},  # Only enabled items
+            "limit": max_items
+        }
+
+        resp = api_call("item.get", params, req_id=601)
+        if "error" in resp or not resp.get("result"):
+            print("[FORCE UPDATE] Failed to get items for update")
+            return False
+
+        items = resp["result"]
     print(f"[FORCE UPDATE] Found {len(items)} items to update")
     
     # Try to force item updates using task.create (if available)
@@ -95,44 +476,69 @@ def force_item_update(hostid: str, max_items: int = 50) -> bool:
     
     if updated_count > 0:
         print(f"[FORCE UPDATE] Successfully triggered updates for {updated_count} items")
-        time.sleep(5)  # Wait for updates to process
+        if FORCE_UPDATE_WAIT_SECONDS > 0:
+            with STATS.phase("force_update_wait"):
+                time.sleep(FORCE_UPDATE_WAIT_SECONDS)  # Wait for updates to process
         return True
     
     return False
 
 # ------------- Enhanced discovery with better filtering -------------
-def discover_hosts() -> List[dict]:
+def discover_hosts(hostids: List[str] = None) -> Optional[List[dict]]:
     params = {
         "output": ["hostid", "host", "name", "status"],
         "selectInventory": ["type", "type_full", "location", "location_lat", "location_lon", "asset_tag"],
         "selectInterfaces": ["interfaceid", "ip", "type", "dns"],
         "filter": {"status": 0}  # Only monitored hosts
     }
+    if hostids is not None:
+        params["hostids"] = hostids
     resp = api_call("host.get", params, req_id=101)
     if "error" in resp:
         print("[ERROR] host.get:", resp["error"])
-        return []
+        return None
     return resp.get("result", [])
 
-def get_items_for_host(hostid: str, include_all: bool = False) -> List[dict]:
-    """Get items for host with better filtering and status information"""
+def host_fingerprints() -> Optional[Dict[str, tuple]]:
+    """Cheap per-host change marker: item count plus linked template ids"""
     params = {
-        "output": ["itemid", "name", "key_", "value_type", "units", "lastvalue", "lastclock", "status", "state", "error"],
-        "hostids": hostid,
-        "sortfield": "name",
-        "limit": 5000
+        "output": ["hostid"],
+        "selectItems": "count",
+        "selectParentTemplates": ["templateid"],
+        "filter": {"status": 0}
     }
-    
-    # Don't filter by status initially to see all items
-    if not include_all:
-        params["filter"] = {"status": 0}  # Only enabled items
-    
-    resp = api_call("item.get", params, req_id=201)
+    resp = api_call("host.get", params, req_id=102)
     if "error" in resp:
-        print("[ERROR] item.get:", resp["error"])
-        return []
-    
-    items = resp.get("result", [])
+        print("[ERROR] host.get (fingerprints):", resp["error"])
+        return None
+    fingerprints = {}
+    for h in resp.get("result", []):
+        templates = tuple(sorted(str(t.get("templateid")) for t in h.get("parentTemplates") or []))
+        fingerprints[str(h.get("hostid"))] = (str(h.get("items", "")), templates)
+    return fingerprints
+
+def get_items_for_host(hostid: str, include_all: bool = False, catalog: "ItemCatalog" = None) -> List[dict]:
+    """Get items for host with better filtering and status information"""
+    if catalog is not None:
+        items = catalog.items_for_host(hostid)
+    else:
+        params = {
+            "output": ITEM_OUTPUT_FIELDS,
+            "hostids": hostid,
+            "sortfield": "name",
+            "limit": 5000
+        }
+
+        # Don't filter by status initially to see all items
+        if not include_all:
+            params["filter"] = {"status": 0}  # Only enabled items
+
+        resp = api_call("item.get", params, req_id=201)
+        if "error" in resp:
+            print("[ERROR] item.get:", resp["error"])
+            return []
+
+        items = resp.get("result", [])
     
     # Debug: Show item status information
     enabled_items = [i for i in items if int(i.get("status", 1)) == 0]
@@ -142,53 +548,552 @@ def get_items_for_host(hostid: str, include_all: bool = False) -> List[dict]:
     
     return enabled_items
 
-def history_last_two(itemid: str, value_type: int = 3) -> Optional[List[dict]]:
-    """Get last two history values with better error handling"""
-    params = {
-        "output": "extend",
-        "history": value_type,
-        "itemids": itemid,
-        "sortfield": "clock",
-        "sortorder": "DESC",
-        "limit": 2
-    }
-    resp = api_call("history.get", params, req_id=301)
-    if "error" in resp:
-        return None
-    return resp.get("result")
+# ------------- Fleet item catalog -------------
+class ItemCatalog:
+    """In-memory index of item.get results for the whole fleet.
+
+    Items are indexed by itemid, by hostid (in item.get name order) and by
+    hostid + SNMP ifindex, so the per-host stages of a cycle read from memory
+    instead of issuing their own item.get calls.
+    """
+
+    def __init__(self):
+        self.by_itemid: Dict[str, dict] = {}
+        self.by_host: Dict[str, List[dict]] = {}
+        self.by_ifindex: Dict[str, Dict[str, List[dict]]] = {}
+        self.ifindex_of: Dict[str, Optional[str]] = {}
+
+    def add(self, items: List[dict]):
+        for item in items:
+            itemid = str(item.get("itemid"))
+            hostid = str(item.get("hostid"))
+            idx = parse_ifindex_from_key(item.get("key_", "") or "")
+            self.by_itemid[itemid] = item
+            self.by_host.setdefault(hostid, []).append(item)
+            self.ifindex_of[itemid] = idx
+            if idx is not None:
+                self.by_ifindex.setdefault(hostid, {}).setdefault(idx, []).append(item)
+
+    def remove_host(self, hostid: str):
+        hostid = str(hostid)
+        for item in self.by_host.pop(hostid, []):
+            itemid = str(item.get("itemid"))
+            self.by_itemid.pop(itemid, None)
+            self.ifindex_of.pop(itemid, None)
+        self.by_ifindex.pop(hostid, None)
+
+    def update_values(self, rows: List[dict]):
+        """Refresh lastvalue/lastclock in place so every index sees the new values"""
+        for row in rows:
+            item = self.by_itemid.get(str(row.get("itemid")))
+            if item is not None:
+                item.update(row)
+
+    def items_for_host(self, hostid: str) -> List[dict]:
+        return self.by_host.get(str(hostid), [])
+
+    def ifindex(self, item: dict) -> Optional[str]:
+        itemid = str(item.get("itemid"))
+        if itemid in self.ifindex_of:
+            return self.ifindex_of[itemid]
+        return parse_ifindex_from_key(item.get("key_", "") or "")
+
+    def __len__(self) -> int:
+        return len(self.by_itemid)
+
+def fetch_item_catalog(hostids: List[str], catalog: ItemCatalog = None, failed: List[str] = None) -> ItemCatalog:
+    """Build (or extend) the item catalog with one item.get per ITEM_CATALOG_HOST_CHUNK hosts.
+
+    Hostids of chunks whose item.get failed are appended to `failed`.
+    """
+    catalog = catalog if catalog is not None else ItemCatalog()
+    hostids = [str(h) for h in hostids if h]
+    for i in range(0, len(hostids), ITEM_CATALOG_HOST_CHUNK):
+        chunk = hostids[i:i + ITEM_CATALOG_HOST_CHUNK]
+        params = {
+            "output": ITEM_OUTPUT_FIELDS,
+            "hostids": chunk,
+            "sortfield": "name"
+        }
+        resp = api_call("item.get", params, req_id=202)
+        if "error" in resp:
+            print("[ERROR] item.get (catalog):", resp["error"])
+            if failed is not None:
+                failed.extend(chunk)
+            continue
+        catalog.add(resp.get("result", []))
+    print(f"[CATALOG] Loaded {len(catalog)} items for {len(hostids)} hosts")
+    return catalog
+
+def refresh_item_values(catalog: ItemCatalog, itemids: List[str]):
+    """Fetch only current values of already known items, ITEM_VALUE_CHUNK itemids per call"""
+    for i in range(0, len(itemids), ITEM_VALUE_CHUNK):
+        params = {
+            "output": ["itemid", "lastvalue", "lastclock", "state", "error"],
+            "itemids": itemids[i:i + ITEM_VALUE_CHUNK]
+        }
+        resp = api_call("item.get", params, req_id=203)
+        if "error" in resp:
+            print("[ERROR] item.get (values):", resp["error"])
+            continue
+        catalog.update_values(resp.get("result", []))
+
+# ------------- host sharding -------------
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+class HashRing:
+    """Consistent-hash ring with SHARD_VNODES virtual nodes per member.
+
+    Adding or removing a member only moves the hosts on the arcs it gains or
+    loses; every instance computes the same ring from the same member list.
+    """
+
+    def __init__(self, members: List[str], vnodes: int = SHARD_VNODES):
+        points = sorted((_ring_hash(f"{m}#{v}"), m) for m in members for v in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.owners = [m for _, m in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.hashes:
+            return None
+        i = bisect.bisect(self.hashes, _ring_hash(key)) % len(self.hashes)
+        return self.owners[i]
+
+class ShardMembership:
+    """Live members of the shard group, from heartbeat files in SHARD_DIR.
+
+    Each instance rewrites <SHARD_DIR>/<shard_id>.json every SHARD_HEARTBEAT_SECONDS
+    from a background thread; files older than SHARD_TTL_SECONDS belong to dead
+    instances and are removed. Reads and writes happen under a lock file
+    created with O_EXCL, which works on any local or shared filesystem.
+    """
+
+    def __init__(self, directory: str, shard_id: str):
+        self.directory = directory
+        self.shard_id = shard_id
+        self.path = os.path.join(directory, f"{shard_id}.json")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.members: List[str] = []
+        self.ring = HashRing([])
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, timeout: float = 10.0):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    # A holder that died leaves the lock behind; break it after the timeout
+                    if time.time() - os.path.getmtime(self.lock_path) > timeout:
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError(f"shard lock {self.lock_path} busy")
+                time.sleep(0.05)
+        try:
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            yield
+        finally:
+            os.close(fd)
+            try:
+                os.remove(self.lock_path)
+            except OSError:
+                pass
+
+    def heartbeat(self):
+        doc = {"id": self.shard_id, "pid": os.getpid(), "host": socket.gethostname(), "ts": time.time()}
+        with self._locked():
+            tmp_file = self.path + ".tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(doc, f)
+            os.replace(tmp_file, self.path)
+
+    def live_members(self) -> List[str]:
+        now = time.time()
+        members = []
+        with self._locked():
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path) as f:
+                        doc = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if now - float(doc.get("ts", 0)) > SHARD_TTL_SECONDS:
+                    print(f"[SHARD] Removing stale member {doc.get('id')}")
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                members.append(str(doc.get("id")))
+        return sorted(members)
+
+    def refresh(self):
+        """Rebuild the ring when members joined or left"""
+        try:
+            members = self.live_members()
+        except (OSError, TimeoutError) as e:
+            print(f"[SHARD] Membership read failed, keeping {len(self.members)} members: {e}")
+            return
+        if self.shard_id not in members:
+            members = sorted(members + [self.shard_id])
+        if members != self.members:
+            print(f"[SHARD] Members {self.members} -> {members}; rebalancing")
+            self.members = members
+            self.ring = HashRing(members)
+
+    def owns(self, hostid: str) -> bool:
+        return self.ring.owner(str(hostid)) == self.shard_id
+
+    def start(self):
+        self.heartbeat()
+        self.refresh()
+
+        def beat():
+            while not self.stop_event.wait(SHARD_HEARTBEAT_SECONDS):
+                try:
+                    self.heartbeat()
+                except (OSError, TimeoutError) as e:
+                    print(f"[SHARD] Heartbeat failed: {e}")
+
+        self.thread = threading.Thread(target=beat, name="shard-heartbeat", daemon=True)
+        self.thread.start()
+
+    def leave(self):
+        # Stop the heartbeat thread first so it cannot recreate the file after removal
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=15)
+        try:
+            with self._locked():
+                os.remove(self.path)
+        except (OSError, TimeoutError):
+            pass
+
+def exit_on_signals():
+    """Turn the first SIGTERM/SIGINT into SystemExit so `finally` cleanup runs.
+
+    Later signals (e.g. the supervisor's SIGTERM right after a group-wide
+    Ctrl-C) are ignored so that cleanup is not interrupted.
+    """
+    def exit_once(signum, frame):
+        signal.signal(signal.SIGTERM, lambda *args: None)
+        signal.signal(signal.SIGINT, lambda *args: None)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, exit_once)
+    signal.signal(signal.SIGINT, exit_once)
+
+def run_shard_supervisor(workers: int):
+    """Run `workers` local agent processes sharing SHARD_DIR, restarting any that exit"""
+    base = os.path.splitext(CACHE_FILE)[0]
+    procs: Dict[int, subprocess.Popen] = {}
+
+    def spawn(i: int) -> subprocess.Popen:
+        env = dict(os.environ)
+        env.update({
+            "SHARD_WORKERS": "0",
+            "SHARD_ID": f"{SHARD_ID}-w{i}",
+            "CACHE_FILE": f"{base}.w{i}.json",
+            "SPOOL_DIR": os.path.join(SPOOL_DIR, f"w{i}") if SPOOL_DIR else "",
+            "AGENT_STATS_FILE": f"{os.path.splitext(AGENT_STATS_FILE)[0]}.w{i}.json" if AGENT_STATS_FILE else "",
+            "AGENT_METRICS_PORT": str(AGENT_METRICS_PORT + i) if AGENT_METRICS_PORT else "0"
+        })
+        print(f"[SHARD] Starting worker {env['SHARD_ID']}")
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    # A plain kill of the supervisor must still stop its workers
+    exit_on_signals()
+    try:
+        for i in range(workers):
+            procs[i] = spawn(i)
+        while True:
+            time.sleep(5)
+            for i, proc in list(procs.items()):
+                if proc.poll() is not None:
+                    print(f"[SHARD] Worker {i} exited with {proc.returncode}, restarting")
+                    procs[i] = spawn(i)
+    except SystemExit:
+        pass
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.wait()
+
+# ------------- Incremental discovery cache -------------
+class DiscoveryCache:
+    """Hosts, item catalog and per-host interface layout reused across cycles.
+
+    Everything is rebuilt every DISCOVERY_REFRESH_SECONDS. In between, a
+    host.get with item counts and linked templates detects added, removed
+    or changed hosts and only those are re-read from Zabbix.
+    """
+
+    def __init__(self, shard: Optional[ShardMembership] = None):
+        self.shard = shard
+        self.hosts: List[dict] = []
+        self.fingerprints: Dict[str, tuple] = {}
+        self.catalog = ItemCatalog()
+        self.network_hostids: Dict[str, bool] = {}
+        self.layouts: Dict[str, dict] = {}
+        self.refreshed_at = 0.0
+
+    def is_expired(self) -> bool:
+        return not self.refreshed_at or time.time() - self.refreshed_at >= DISCOVERY_REFRESH_SECONDS
+
+    def forget_host(self, hostid: str):
+        self.catalog.remove_host(hostid)
+        self.network_hostids.pop(hostid, None)
+        self.layouts.pop(hostid, None)
+
+def refresh_discovery(discovery: DiscoveryCache):
+    """Bring hosts and item catalog up to date, re-reading only what changed.
+
+    In sharded mode only owned hosts are kept; hosts gained or lost on a
+    rebalance show up as new or removed fingerprints and are handled like
+    any other topology change.
+    """
+    fingerprints = host_fingerprints()
+    owns = lambda hid: True
+    if discovery.shard is not None:
+        discovery.shard.refresh()
+        owns = discovery.shard.owns
+        if fingerprints is not None:
+            fingerprints = {hid: fp for hid, fp in fingerprints.items() if owns(hid)}
+
+    if discovery.is_expired():
+        # Nothing is committed unless host.get and every catalog chunk succeed, so a
+        # Zabbix error keeps the previous topology and the refresh is retried next cycle
+        if fingerprints is None:
+            return
+        found = discover_hosts()
+        if found is None:
+            print("[DISCOVERY] Full refresh failed, keeping the cached topology")
+            return
+        hosts = [h for h in found if owns(h.get("hostid"))]
+        catalog, failed = ItemCatalog(), []
+        fetch_item_catalog([h["hostid"] for h in hosts if not is_zabbix_server_host(h) and h.get("hostid")],
+                           catalog, failed)
+        if failed:
+            print(f"[DISCOVERY] Full refresh failed for {len(failed)} hosts, keeping the cached topology")
+            return
+        discovery.catalog = catalog
+        discovery.network_hostids = {}
+        discovery.layouts = {}
+        discovery.hosts = hosts
+        discovery.fingerprints = fingerprints
+        discovery.refreshed_at = time.time()
+        CLASSIFIER.retain(discovery.catalog.by_itemid)
+        print(f"[DISCOVERY] Full refresh: {len(hosts)} hosts, {len(discovery.catalog)} items")
+        return
+
+    if fingerprints is None:
+        return  # Keep using the cached topology
+
+    known = discovery.fingerprints
+    removed = [hid for hid in known if hid not in fingerprints]
+    changed = [hid for hid, fp in fingerprints.items() if known.get(hid) != fp]
+    if not removed and not changed:
+        return
+
+    print(f"[DISCOVERY] Topology change: {len(changed)} new/changed, {len(removed)} removed hosts")
+    fresh, failed = [], []
+    if changed:
+        fresh = discover_hosts(changed)
+        if fresh is None:
+            # Apply removals only; changed hosts keep their old state and fingerprint
+            fresh, failed = [], list(changed)
+        catalog = ItemCatalog()
+        fetch_item_catalog([h["hostid"] for h in fresh if not is_zabbix_server_host(h) and h.get("hostid")],
+                           catalog, failed)
+    retry = set(failed)
+    if retry:
+        print(f"[DISCOVERY] Could not re-read {len(retry)} hosts, retrying next cycle")
+
+    dropped = {hid for hid in removed + changed if hid not in retry}
+    for hid in dropped:
+        discovery.forget_host(hid)
+    hosts = [h for h in discovery.hosts if str(h.get("hostid")) not in dropped]
+    for h in fresh:
+        hid = str(h.get("hostid"))
+        if hid in retry:
+            continue
+        hosts.append(h)
+        discovery.catalog.add(catalog.items_for_host(hid))
+    hosts.sort(key=lambda h: int(h.get("hostid") or 0))
+    discovery.hosts = hosts
+    discovery.fingerprints = {hid: (known[hid] if hid in retry else fp)
+                              for hid, fp in fingerprints.items() if hid not in retry or hid in known}
+
+def history_last_two_batch(items: List[dict], window: int = None) -> Dict[str, List[dict]]:
+    """Get the last two history values for many items with one history.get per value_type.
+
+    Items are grouped by value_type (history.get only reads one history table per
+    call), each group is fetched over a time_from window and the rows are split
+    per itemid on the client, newest first.
+    """
+    window = window or HISTORY_WINDOW_SECONDS
+    by_type: Dict[int, List[str]] = {}
+    for item in items:
+        by_type.setdefault(int(item.get("value_type", 3)), []).append(str(item.get("itemid")))
+
+    result: Dict[str, List[dict]] = {}
+    time_from = int(time.time()) - window
+    for value_type, itemids in by_type.items():
+        for i in range(0, len(itemids), HISTORY_BATCH_SIZE):
+            chunk = itemids[i:i + HISTORY_BATCH_SIZE]
+            params = {
+                "output": ["itemid", "clock", "value"],
+                "history": value_type,
+                "itemids": chunk,
+                "time_from": time_from,
+                "sortfield": "clock",
+                "sortorder": "DESC"
+            }
+            resp = api_call("history.get", params, req_id=302)
+            if "error" in resp:
+                continue
+            for row in resp.get("result") or []:
+                samples = result.setdefault(str(row.get("itemid")), [])
+                if len(samples) < 2:
+                    samples.append(row)
+    return result
+
+# ------------- Item classification -------------
+# Term lists used to classify items; all matching is case-insensitive substring matching
+HOST_NETWORK_TERMS = ["if", "interface", "net", "traffic", "octets", "snmp",
+                      "fa0", "gi0", "eth", "cisco", "router", "switch"]
+NETWORK_PATTERN_TERMS = ["fa0", "gi0", "eth", "port", "link"]
+NETWORK_ITEM_REGEX = re.compile(r'interface|if\w*\[|octets|traffic|bandwidth', re.I)
+TRAFFIC_TERMS = ["in", "out", "octets", "traffic", "bandwidth"]
+INTERFACE_NAMES = ["Fa0/0", "Fa0/1", "GigabitEthernet", "FastEthernet", "Ethernet"]
+SYSTEM_TERMS = ["system", "cpu", "memory", "uptime", "snmp", "chassis", "fan", "power", "temperature"]
+IFDESCR_SEARCH_TERMS = ["ifDescr", "Interface", "Description"]
+
+class ItemClass:
+    """Classification result of one item"""
+    __slots__ = ("host_hint", "network", "traffic", "oper_status", "group", "ifindex", "ifdescr_terms")
+
+    def __init__(self, host_hint, network, traffic, oper_status, group, ifindex, ifdescr_terms):
+        self.host_hint = host_hint          # counts towards "this host is a network device"
+        self.network = network              # kept by the network item filter
+        self.traffic = traffic              # counter that gets a rate
+        self.oper_status = oper_status      # ifOperStatus-like item
+        self.group = group                  # if_<idx>, interface name, _system or _other
+        self.ifindex = ifindex              # SNMP index from the key, if any
+        self.ifdescr_terms = ifdescr_terms  # indexes into IFDESCR_SEARCH_TERMS matched by the name
+
+    @property
+    def kind(self) -> str:
+        if self.oper_status:
+            return "oper-status"
+        if self.traffic:
+            return "traffic"
+        if self.group == "_system":
+            return "system"
+        if self.network:
+            return "network"
+        return "other"
+
+def _any_term_regex(terms: List[str]):
+    return re.compile("|".join(re.escape(t.lower()) for t in terms))
+
+def _ordered_terms_regex(terms: List[str]):
+    # Zero-width lookahead reports a match at every position, so overlapping terms are all seen
+    return re.compile("(?=(" + "|".join(re.escape(t.lower()) for t in terms) + "))")
+
+class ItemClassifier:
+    """Compiled, memoized classification of Zabbix items.
+
+    Every term list is compiled into a single regex and the result is cached
+    per (itemid, key_, name), so an item is only classified again when its key
+    or name changes.
+    """
+
+    def __init__(self):
+        self._host_re = _any_term_regex(HOST_NETWORK_TERMS)
+        self._network_re = _any_term_regex(NETWORK_ITEM_TERMS + NETWORK_PATTERN_TERMS)
+        self._traffic_re = _any_term_regex(TRAFFIC_TERMS)
+        self._system_re = _any_term_regex(SYSTEM_TERMS)
+        self._iface_re = _ordered_terms_regex(INTERFACE_NAMES)
+        self._iface_rank = {t.lower(): i for i, t in enumerate(INTERFACE_NAMES)}
+        self._ifdescr_re = _ordered_terms_regex(IFDESCR_SEARCH_TERMS)
+        self._ifdescr_rank = {t.lower(): i for i, t in enumerate(IFDESCR_SEARCH_TERMS)}
+        self._memo: Dict[tuple, ItemClass] = {}
+
+    def classify(self, item: dict) -> ItemClass:
+        raw_key = item.get("key_") or ""
+        raw_name = item.get("name") or ""
+        memo_key = (str(item.get("itemid")), raw_key, raw_name)
+        cls = self._memo.get(memo_key)
+        if cls is None:
+            cls = self._classify(raw_key, raw_name)
+            self._memo[memo_key] = cls
+        return cls
+
+    def _first_term(self, regex, rank: Dict[str, int], *texts: str) -> Optional[int]:
+        best = None
+        for text in texts:
+            for m in regex.finditer(text):
+                r = rank[m.group(1)]
+                if best is None or r < best:
+                    best = r
+        return best
+
+    def _classify(self, raw_key: str, raw_name: str) -> ItemClass:
+        key = raw_key.lower()
+        name = (raw_name or raw_key).lower()
+
+        host_hint = bool(self._host_re.search(key) or self._host_re.search(name))
+        network = ALL_ITEMS or bool(
+            self._network_re.search(key) or self._network_re.search(name) or
+            NETWORK_ITEM_REGEX.search(raw_key + raw_name)
+        )
+        traffic = bool(self._traffic_re.search(key) or self._traffic_re.search(name))
+        oper_status = "status" in name and "oper" in name
+
+        ifindex = parse_ifindex_from_key(raw_key)
+        if ifindex:
+            group = f"if_{ifindex}"
+        else:
+            iface = self._first_term(self._iface_re, self._iface_rank, name, key)
+            if iface is not None:
+                group = INTERFACE_NAMES[iface]
+            elif self._system_re.search(name) or self._system_re.search(key):
+                group = "_system"
+            else:
+                group = "_other"
+
+        ifdescr_terms = frozenset(self._ifdescr_rank[m.group(1)] for m in self._ifdescr_re.finditer(raw_name.lower()))
+        return ItemClass(host_hint, network, traffic, oper_status, group, ifindex, ifdescr_terms)
+
+    def retain(self, itemids):
+        """Drop memoized results of items that no longer exist"""
+        itemids = set(itemids)
+        for memo_key in [k for k in self._memo if k[0] not in itemids]:
+            del self._memo[memo_key]
+
+CLASSIFIER = ItemClassifier()
 
 # ------------- Dynamic interface discovery -------------
-def discover_interfaces_dynamically(items: List[dict]) -> Dict[str, List[str]]:
+def discover_interfaces_dynamically(items: List[dict]) -> Dict[str, List[dict]]:
     """Dynamically discover interface patterns from item keys and names"""
     interface_patterns = {}
     
     for item in items:
-        key = item.get("key_", "")
-        name = item.get("name", "")
-        
-        # Look for interface indices in keys like [1], [2], etc.
-        idx_match = re.search(r'\[(\d+)\]', key)
-        if idx_match:
-            idx = idx_match.group(1)
-            interface_patterns.setdefault(f"if_{idx}", []).append(item)
-            continue
-        
-        # Look for common interface names
-        interface_names = ["Fa0/0", "Fa0/1", "GigabitEthernet", "FastEthernet", "Ethernet"]
-        found_interface = False
-        for iface_name in interface_names:
-            if iface_name.lower() in name.lower() or iface_name.lower() in key.lower():
-                interface_patterns.setdefault(iface_name, []).append(item)
-                found_interface = True
-                break
-        
-        if not found_interface:
-            # Check for system-level items
-            system_terms = ["system", "cpu", "memory", "uptime", "snmp", "chassis", "fan", "power", "temperature"]
-            if any(term.lower() in name.lower() or term.lower() in key.lower() for term in system_terms):
-                interface_patterns.setdefault("_system", []).append(item)
-            else:
-                interface_patterns.setdefault("_other", []).append(item)
+        # Interface index in keys like [1], [2], else a known interface name, else system/other
+        interface_patterns.setdefault(CLASSIFIER.classify(item).group, []).append(item)
     
     return interface_patterns
 
@@ -202,11 +1107,59 @@ def load_cache() -> dict:
 
 def save_cache(cache: dict):
     try:
-        with open(CACHE_FILE, "w") as f:
-            json.dump(cache, f, indent=2)
+        # Write to a temp file first so a crash never leaves a truncated cache behind
+        tmp_file = CACHE_FILE + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, CACHE_FILE)
     except Exception as e:
         print("[CACHE ERROR] failed to save:", e)
 
+def prune_counter_cache(cache: dict, catalog: "ItemCatalog"):
+    """Forget counter samples of items that no longer exist in Zabbix"""
+    counters = cache.get("counters", {})
+    for itemid in [i for i in counters if i not in catalog.by_itemid]:
+        del counters[itemid]
+
+def prune_event_state(cache: dict, catalog: "ItemCatalog"):
+    """Forget event states of items that no longer exist in Zabbix"""
+    event_state = cache.get("events", {})
+    for key in [k for k, v in event_state.items() if v.get("itemid") not in catalog.by_itemid]:
+        del event_state[key]
+
+# ------------- event state transitions -------------
+def should_emit_event(event_state: dict, itemid: str, event_doc: dict) -> bool:
+    """Track the last status/severity per (device_id, iface, metric) and decide whether to send.
+
+    Transitions are annotated with the previous status and a "state-change"
+    label, periodic repeats of an unchanged state with a "heartbeat" label.
+    The state lives in the agent cache, so it survives restarts.
+    """
+    key = json.dumps([event_doc["device_id"], event_doc["iface"], event_doc["metric"]])
+    prev = event_state.get(key)
+    now = event_doc["detected_at"]
+    status, severity = event_doc["status"], event_doc["severity"]
+
+    changed = prev is None or prev["status"] != status or prev["severity"] != severity
+    heartbeat = (not changed and EVENT_HEARTBEAT_SECONDS > 0
+                 and now - prev.get("emitted_at", 0) >= EVENT_HEARTBEAT_SECONDS)
+    emit = changed or heartbeat or EVENT_MODE == "all"
+
+    if changed and prev is not None:
+        event_doc["evidence"]["previous_status"] = prev["status"]
+        event_doc["evidence"]["previous_severity"] = prev["severity"]
+        event_doc["labels"].append("state-change")
+    elif heartbeat:
+        event_doc["labels"].append("heartbeat")
+
+    event_state[key] = {
+        "itemid": itemid,
+        "status": status,
+        "severity": severity,
+        "emitted_at": now if emit else prev.get("emitted_at", now)
+    }
+    return emit
+
 # ------------- utilities -------------
 RFC1918_PATTERNS = [
     re.compile(r"^10\."), 
@@ -226,7 +1179,7 @@ def geoip_lookup(ip: str) -> dict:
     if not ip or is_private_ip(ip):
         return {}
     try:
-        r = requests.get(GEOIP_URL + ip, timeout=5)
+        r = get_session("geoip").get(GEOIP_URL + ip, timeout=5)
         if r.status_code != 200:
             return {}
         data = r.json()
@@ -269,6 +1222,55 @@ def safe_compute_rate(old_val: float, old_ts: int, new_val: float, new_ts: int,
         return None
     return bytes_per_sec
 
+def rate_from_history(hist: Optional[List[dict]], key: str) -> Optional[float]:
+    """Bits per second from the two newest history samples (newest first)"""
+    if not hist or len(hist) < 2:
+        return None
+    new_v = float(hist[0]["value"])
+    old_v = float(hist[1]["value"])
+    new_ts = int(hist[0]["clock"])
+    old_ts = int(hist[1]["clock"])
+    maxc = guess_counter_max(key)
+    bps = safe_compute_rate(old_v, old_ts, new_v, new_ts, maxc)
+    return bps * 8.0 if bps is not None else None  # Convert to bits per second
+
+def local_counter_rate(counters: dict, item: dict, key: str) -> Tuple[bool, Optional[float]]:
+    """Compute a traffic rate from the previous (lastvalue, lastclock) kept in the cache.
+
+    Returns (resolved, rate_bps). resolved is False on a cold start, when the
+    clock went backwards or when the gap since the cached sample exceeds
+    RATE_MAX_GAP_SECONDS; the caller then falls back to history.get.
+    """
+    itemid = str(item.get("itemid"))
+    try:
+        value = float(item.get("lastvalue"))
+        clock = int(item.get("lastclock") or 0)
+    except (TypeError, ValueError):
+        return True, None  # Not a numeric counter, history cannot help either
+
+    prev = counters.get(itemid)
+    if prev is None:
+        return False, None
+    if clock == prev["clock"]:
+        # Zabbix has no newer sample, the previous rate still holds
+        return True, prev.get("rate_bps")
+    if clock < prev["clock"] or clock - prev["clock"] > RATE_MAX_GAP_SECONDS:
+        return False, None
+
+    bps = safe_compute_rate(prev["value"], prev["clock"], value, clock, guess_counter_max(key))
+    rate_bps = bps * 8.0 if bps is not None else None  # Convert to bits per second
+    counters[itemid] = {"value": value, "clock": clock, "rate_bps": rate_bps}
+    return True, rate_bps
+
+def remember_counter_sample(counters: dict, item: dict, rate_bps: Optional[float]):
+    """Seed the counter cache after a history fallback"""
+    try:
+        value = float(item.get("lastvalue"))
+        clock = int(item.get("lastclock") or 0)
+    except (TypeError, ValueError):
+        return
+    counters[str(item.get("itemid"))] = {"value": value, "clock": clock, "rate_bps": rate_bps}
+
 def oper_status_is_up(value: str) -> Optional[bool]:
     if value is None:
         return None
@@ -285,11 +1287,22 @@ def oper_status_is_up(value: str) -> Optional[bool]:
     return None
 
 # ------------- ifDescr mapping -------------
-def get_ifdescr_map(hostid: str) -> Dict[str, str]:
+def get_ifdescr_map(hostid: str, catalog: ItemCatalog = None) -> Dict[str, str]:
     mapping: Dict[str, str] = {}
     
     # Try multiple approaches to get interface descriptions
-    search_terms = ["ifDescr", "Interface", "Description"]
+    search_terms = IFDESCR_SEARCH_TERMS
+
+    if catalog is not None:
+        # Same matching as item.get "search" on name (case-insensitive substring)
+        host_items = [(it, CLASSIFIER.classify(it)) for it in catalog.items_for_host(hostid)]
+        for term_index in range(len(search_terms)):
+            for it, cls in host_items:
+                if term_index not in cls.ifdescr_terms or not cls.ifindex:
+                    continue
+                last = it.get("lastvalue") or ""
+                mapping[cls.ifindex] = str(last if last else it.get("name") or "")
+        return mapping
     
     for term in search_terms:
         params = {
@@ -314,44 +1327,621 @@ def get_ifdescr_map(hostid: str) -> Dict[str, str]:
     return mapping
 
 # ------------- backend post helpers -------------
-def post_with_retries(url: str, json_payload, max_retries: int = 3, backoff: float = 1.0):
+def is_permanent_status(status_code: int) -> bool:
+    """4xx responses mean the backend will never accept this body (408/429 are worth retrying)"""
+    return 400 <= status_code < 500 and status_code not in (408, 429)
+
+def post_with_retries(url: str, json_payload, max_retries: int = 3, backoff: float = 1.0,
+                      wire_format: str = "json") -> Tuple[bool, str, bool]:
+    """POST a batch, returning (ok, response text or error, permanent failure)"""
     if not url:
         print(f"[POST] No URL configured for backend POST: {url}")
-        return False, "no_url_configured"
+        return False, "no_url_configured", False
     print(f"[POST] Attempting to POST to {url}")
     print(f"[POST] Payload (truncated to 1000 chars): {json.dumps(json_payload)[:1000]}")
+    body, headers = encode_ingest_body(json_payload, wire_format)
+    method = "POST " + urlparse(url).path
     for attempt in range(1, max_retries + 1):
+        start = time.perf_counter()
         try:
-            r = requests.post(url, json=json_payload, timeout=8)
+            r = get_session("backend").post(url, data=body, headers=headers, timeout=8)
+            STATS.record_call("backend", method, time.perf_counter() - start, 200 <= r.status_code < 300,
+                              len(body), _response_size(r))
             print(f"[POST] Response status: {r.status_code}")
             print(f"[POST] Response body (truncated to 1000 chars): {r.text[:1000]}")
             if 200 <= r.status_code < 300:
-                return True, r.text
-            else:
-                err = f"{r.status_code} {r.text}"
+                return True, r.text, False
+            err = f"{r.status_code} {r.text}"
+            if is_permanent_status(r.status_code):
+                print(f"[POST] Rejected with {r.status_code}, not retrying")
+                return False, err, True
         except Exception as e:
+            STATS.record_call("backend", method, time.perf_counter() - start, False, len(body))
             err = str(e)
             print(f"[POST] Exception during POST: {err}")
         if attempt < max_retries:
             print(f"[POST] Retry {attempt} failed, retrying after {backoff * attempt}s...")
             time.sleep(backoff * attempt)
     print(f"[POST] All retries failed. Last error: {err}")
-    return False, err
+    return False, err, False
+
+# ------------- durable ingest spool -------------
+class IngestSpool:
+    """Append-only, segment based on-disk queue of batches the backend rejected.
+
+    Each failed batch is one JSON line in segment-<seq>.log. ack.json records
+    how far replay got; segments that are fully acknowledged are deleted and,
+    when the spool would exceed SPOOL_MAX_BYTES, the oldest segments are
+    dropped first. Only the sender thread uses it, the lock is a safety net.
+    """
+
+    ACK_FILE = "ack.json"
+    DEAD_LETTER_FILE = "dead-letter.log"
+
+    def __init__(self, directory: str, max_bytes: int = SPOOL_MAX_BYTES, segment_bytes: int = SPOOL_SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.ack = self._load_ack()
+        self.dropped_batches = 0
+
+    # --- files ---
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"segment-{seq:012d}.log")
+
+    def _segments(self) -> List[int]:
+        seqs = []
+        for fname in os.listdir(self.directory):
+            if fname.startswith("segment-") and fname.endswith(".log"):
+                try:
+                    seqs.append(int(fname[8:-4]))
+                except ValueError:
+                    pass
+        return sorted(seqs)
+
+    def _load_ack(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, self.ACK_FILE), "r") as f:
+                ack = json.load(f)
+                return {"segment": int(ack["segment"]), "offset": int(ack["offset"])}
+        except Exception:
+            segments = self._segments()
+            return {"segment": segments[0] if segments else 0, "offset": 0}
+
+    def _save_ack(self):
+        path = os.path.join(self.directory, self.ACK_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.ack, f)
+        os.replace(path + ".tmp", path)
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(self._segment_path(seq)) for seq in self._segments())
+
+    # --- writing ---
+    def append(self, kind: str, docs: List[dict]):
+        line = (json.dumps({"kind": kind, "docs": docs}) + "\n").encode("utf-8")
+        with self.lock:
+            segments = self._segments()
+            total = sum(os.path.getsize(self._segment_path(seq)) for seq in segments)
+
+            # Enforce the disk cap by dropping the oldest segments
+            while segments and total + len(line) > self.max_bytes:
+                oldest = segments.pop(0)
+                path = self._segment_path(oldest)
+                total -= os.path.getsize(path)
+                with open(path, "rb") as f:
+                    self.dropped_batches += sum(1 for _ in f)
+                os.remove(path)
+                print(f"[SPOOL] Disk cap reached, dropped segment {oldest} ({self.dropped_batches} batches dropped so far)")
+                if self.ack["segment"] <= oldest:
+                    self.ack = {"segment": segments[0] if segments else oldest + 1, "offset": 0}
+                    self._save_ack()
+
+            seq = segments[-1] if segments else self.ack["segment"]
+            path = self._segment_path(seq)
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > self.segment_bytes:
+                seq += 1
+                path = self._segment_path(seq)
+            with open(path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        print(f"[SPOOL] Stored {len(docs)} {kind} in segment {seq}")
+
+    def dead_letter(self, kind: str, docs: List[dict], reason: str):
+        """Set aside a batch the backend rejected permanently, up to one segment of them"""
+        line = (json.dumps({"kind": kind, "reason": reason, "docs": docs}) + "\n").encode("utf-8")
+        path = os.path.join(self.directory, self.DEAD_LETTER_FILE)
+        with self.lock:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size + len(line) > self.segment_bytes:
+                print(f"[SPOOL] Dead-letter file full, discarding {len(docs)} rejected {kind}")
+                return
+            with open(path, "ab") as f:
+                f.write(line)
+        print(f"[SPOOL] Moved {len(docs)} rejected {kind} to {self.DEAD_LETTER_FILE}")
+
+    # --- replay ---
+    def has_pending(self) -> bool:
+        with self.lock:
+            segments = self._segments()
+            if not segments:
+                return False
+            last = segments[-1]
+            if self.ack["segment"] < last:
+                return True
+            return self.ack["segment"] == last and self.ack["offset"] < os.path.getsize(self._segment_path(last))
+
+    def peek(self) -> Optional[Tuple[str, List[dict], dict]]:
+        """Oldest unacknowledged batch as (kind, docs, position after it)"""
+        with self.lock:
+            for seq in self._segments():
+                if seq < self.ack["segment"]:
+                    continue
+                offset = self.ack["offset"] if seq == self.ack["segment"] else 0
+                with open(self._segment_path(seq), "rb") as f:
+                    f.seek(offset)
+                    while True:
+                        raw = f.readline()
+                        if not raw.endswith(b"\n"):
+                            break  # end of segment (or a torn write from a crash)
+                        next_pos = {"segment": seq, "offset": f.tell()}
+                        try:
+                            record = json.loads(raw)
+                            return record["kind"], record["docs"], next_pos
+                        except (ValueError, KeyError):
+                            self.ack = next_pos  # skip a corrupt line
+                self._compact(seq)
+            return None
+
+    def commit(self, position: dict):
+        """Acknowledge everything up to position and remove fully replayed segments"""
+        with self.lock:
+            self.ack = dict(position)
+            self._save_ack()
+
+    def _compact(self, seq: int):
+        segments = self._segments()
+        if seq != segments[-1]:
+            # Fully read and not the segment being written: nothing in it is needed anymore
+            os.remove(self._segment_path(seq))
+            self.ack = {"segment": seq + 1, "offset": 0}
+            self._save_ack()
+
+class BackendSender:
+    """Background thread that posts metric/event chunks while collection continues.
+
+    Hosts hand over their documents as soon as they are processed; they are
+    split into SEND_CHUNK_SIZE chunks and queued on a bounded queue, so a slow
+    backend blocks collection (backpressure) instead of growing memory.
+    """
+
+    def __init__(self, max_queue: int = SEND_QUEUE_MAX, chunk_size: int = SEND_CHUNK_SIZE,
+                 spool: Optional[IngestSpool] = None):
+        self.chunk_size = chunk_size
+        self.spool = spool
+        self.replay_interval = 1.0 / SPOOL_REPLAY_RATE if SPOOL_REPLAY_RATE > 0 else None
+        self.last_replay = 0.0
+        self.queue: "queue.Queue[Optional[Tuple[str, str, List[dict]]]]" = queue.Queue(maxsize=max_queue)
+        self.thread: Optional[threading.Thread] = None
+        self.sent = {"metrics": 0, "events": 0}
+        self.failed = {"metrics": 0, "events": 0}
+        self.closing = False
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="backend-sender", daemon=True)
+            self.thread.start()
+
+    def submit(self, kind: str, url: Optional[str], docs: List[dict]):
+        """Queue documents of one kind ("metrics" or "events"), blocking while the queue is full"""
+        if not url or not docs:
+            return
+        for i in range(0, len(docs), self.chunk_size):
+            self.queue.put((kind, url, docs[i:i + self.chunk_size]))
+
+    def flush(self):
+        """Wait until everything queued so far has been posted"""
+        self.queue.join()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        """Stop on exit without losing queued chunks: they are spooled if a spool exists, else posted"""
+        self.closing = True
+        self.stop()
+
+    def _run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=self.replay_interval or 1.0)
+            except queue.Empty:
+                self._replay_spooled()
+                continue
+            try:
+                if job is None:
+                    return
+                kind, url, docs = job
+                if self.closing and self.spool is not None:
+                    self.spool.append(kind, docs)
+                    continue
+                print(f"[BACKEND] Sending {len(docs)} {kind}...")
+                ok, resp, permanent = post_with_retries(url, docs, wire_format=self._wire_format(kind))
+                print(f"[BACKEND] {kind.capitalize()} posted: {ok} - {resp[:100] if resp else 'No response'}")
+                (self.sent if ok else self.failed)[kind] += len(docs)
+                if not ok and permanent:
+                    # Replaying a batch the backend rejects would block the spool forever
+                    print(f"[BACKEND] Dropping {len(docs)} {kind} rejected by the backend")
+                elif not ok and self.spool is not None:
+                    self.spool.append(kind, docs)
+                elif ok:
+                    self._replay_spooled()
+            except Exception as e:
+                print(f"[BACKEND] Sender error: {e}")
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def _wire_format(kind: str) -> str:
+        return BACKEND_WIRE_FORMAT if kind == "metrics" else "json"
+
+    def _replay_spooled(self):
+        """Replay at most one spooled batch, no more often than SPOOL_REPLAY_RATE per second"""
+        if self.spool is None or self.replay_interval is None or self.closing:
+            return
+        if time.time() - self.last_replay < self.replay_interval or not self.spool.has_pending():
+            return
+        self.last_replay = time.time()
+        batch = self.spool.peek()
+        if batch is None:
+            return
+        kind, docs, position = batch
+        url = {"metrics": BACKEND_METRICS_ENDPOINT, "events": BACKEND_EVENTS_ENDPOINT}.get(kind)
+        if not url:
+            return
+        print(f"[SPOOL] Replaying {len(docs)} {kind}")
+        ok, resp, permanent = post_with_retries(url, docs, max_retries=1, wire_format=self._wire_format(kind))
+        if ok:
+            self.spool.commit(position)
+            self.sent[kind] += len(docs)
+        elif permanent:
+            self.spool.dead_letter(kind, docs, resp[:200])
+            self.spool.commit(position)
+
+# ------------- concurrency helpers -------------
+def map_hosts(fn: Callable[[dict], Any], hosts: List[dict]) -> List[Any]:
+    """Apply fn to every host, running up to ZABBIX_MAX_CONCURRENCY hosts at once.
+
+    Results are returned in the same order as hosts, so the output of a cycle is
+    identical to the serial path regardless of which host finishes first.
+    """
+    if ZABBIX_MAX_CONCURRENCY <= 1 or len(hosts) <= 1:
+        return [fn(h) for h in hosts]
+    workers = min(ZABBIX_MAX_CONCURRENCY, len(hosts))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zbx-host") as pool:
+        return list(pool.map(fn, hosts))
+
+# ------------- per-host pipeline -------------
+def is_zabbix_server_host(h: dict) -> bool:
+    hostname = h.get("host", "").lower()
+    return "zabbix" in hostname or "server" in hostname
+
+def is_network_host(items_sample: List[dict]) -> bool:
+    """Decide whether a host is a network device from its enabled items"""
+    # Any item matching network or router/switch patterns is enough
+    if any(CLASSIFIER.classify(item).host_hint for item in items_sample):
+        return True
+
+    # If many items, likely a network device
+    return len(items_sample) > 10
+
+def build_host_layout(hostid: str, catalog: ItemCatalog) -> dict:
+    """Network items, interface groups and ifDescr labels of a host (structure only)"""
+    items = get_items_for_host(hostid, include_all=True, catalog=catalog)
+
+    # Filter for network items (everything when ALL_ITEMS is set)
+    network_items = [item for item in items if CLASSIFIER.classify(item).network]
+
+    return {
+        "items": items,
+        "network_items": network_items,
+        # Dynamically discover interface groupings
+        "interface_groups": discover_interfaces_dynamically(network_items) if network_items else {},
+        # Get interface descriptions mapping
+        "ifdescr_map": _timed_ifdescr_map(hostid, catalog) if network_items else {}
+    }
+
+def _timed_ifdescr_map(hostid: str, catalog: ItemCatalog) -> Dict[str, str]:
+    with STATS.phase("ifdescr_map"):
+        return get_ifdescr_map(hostid, catalog)
+
+def process_network_host(nh: dict, discovery: DiscoveryCache, cache: dict) -> Tuple[List[dict], List[dict]]:
+    """Collect metric and event documents for a single network device"""
+    metrics: List[dict] = []
+    events: List[dict] = []
+
+    hostid = nh.get("hostid")
+    dev = nh.get("host")
+
+    # Interface layout is reused until discovery sees a change on this host
+    layout = discovery.layouts.get(hostid)
+    if layout is None:
+        layout = build_host_layout(hostid, discovery.catalog)
+        discovery.layouts[hostid] = layout
+
+    print(f"\n[PROCESSING] {dev} (HostID: {hostid})")
+
+    # Get all items for this host (including those without recent checks)
+    items = layout["items"]
+    if not items:
+        print(f"[{dev}] No items found at all.")
+        return metrics, events
+
+    print(f"[{dev}] Found {len(items)} total items")
+
+    # Show sample of items for debugging
+    print(f"[{dev}] Sample items:")
+    for i, item in enumerate(items[:10]):
+        status = "Enabled" if int(item.get("status", 1)) == 0 else "Disabled"
+        lastclock = item.get("lastclock")
+        age = "Never" if not lastclock else f"{int(time.time()) - int(lastclock)}s ago"
+        print(f"  {i+1}. {item.get('name', 'N/A')[:50]} | Status: {status} | Last: {age}")
+
+    network_items = layout["network_items"]
+    print(f"[{dev}] Found {len(network_items)} network items")
+
+    if len(network_items) == 0:
+        print(f"[{dev}] No network items found. Skipping.")
+        return metrics, events
+
+    interface_groups = layout["interface_groups"]
+    print(f"[{dev}] Discovered interface groups: {list(interface_groups.keys())}")
+
+    ifdescr_map = layout["ifdescr_map"]
+
+    traffic_items = [
+        item for item in network_items
+        if item.get("lastvalue") not in (None, "")
+        and CLASSIFIER.classify(item).traffic
+    ]
+
+    # Rates come from the local counter cache; only cold or gapped counters need history
+    counters = cache.setdefault("counters", {})
+    event_state = cache.setdefault("events", {})
+    local_rates: Dict[str, Optional[float]] = {}
+    need_history = []
+    for item in traffic_items:
+        resolved, rate = local_counter_rate(counters, item, item.get("key_") or "")
+        if resolved:
+            local_rates[str(item.get("itemid"))] = rate
+        else:
+            need_history.append(item)
+    with STATS.phase("history"):
+        history_map = history_last_two_batch(need_history) if need_history else {}
+
+    # Geo location handling (same for every item on the host)
+    raw_inventory = nh.get("inventory", {})
+    location_str = "Unknown Location"
+    geo = {"lat": None, "lon": None, "source": "unknown"}
+
+    if isinstance(raw_inventory, dict):
+        location_str = raw_inventory.get("location", "Unknown Location")
+        if raw_inventory.get("location_lat"):
+            geo["lat"] = float(raw_inventory["location_lat"])
+        if raw_inventory.get("location_lon"):
+            geo["lon"] = float(raw_inventory["location_lon"])
+        if geo["lat"] and geo["lon"]:
+            geo["source"] = "zabbix_inventory"
+
+    # Process each interface group
+    for group_name, group_items in interface_groups.items():
+        if group_name == "_system":
+            iface_label = "System"
+        elif group_name == "_other":
+            iface_label = "Other"
+        elif group_name.startswith("if_"):
+            idx = group_name[3:]
+            iface_label = ifdescr_map.get(idx, f"Interface {idx}")
+        else:
+            iface_label = group_name
+
+        # Process each item in the group
+        for item in group_items:
+            itemid = str(item.get("itemid"))
+            key = item.get("key_") or ""
+            name = item.get("name") or key
+            raw_value = item.get("lastvalue")
+            lastclock = item.get("lastclock")
+
+            # Skip items with no value
+            if raw_value is None or raw_value == "":
+                print(f"[{dev}] {iface_label} - {name}: No data available")
+                continue
+
+            # Determine data freshness
+            age_seconds = 0
+            if lastclock:
+                age_seconds = int(time.time()) - int(lastclock)
+
+            freshness = "Fresh" if age_seconds < 300 else f"Stale ({age_seconds}s)"
+
+            # Calculate rate for traffic items
+            rate_bps = None
+            cls = CLASSIFIER.classify(item)
+            traffic = cls.traffic
+
+            if itemid in local_rates:
+                rate_bps = local_rates[itemid]
+            elif traffic:
+                # Cold start or gap: rate from the batched history samples
+                try:
+                    rate_bps = rate_from_history(history_map.get(itemid), key)
+                except Exception as e:
+                    print(f"[{dev}] Rate calculation error for {name}: {e}")
+                remember_counter_sample(counters, item, rate_bps)
+
+            # Determine status
+            status = "Up"  # Default
+            if cls.oper_status:
+                status = "Up" if oper_status_is_up(raw_value) else "Down"
+            elif traffic and rate_bps is not None:
+                status = "Active" if rate_bps > 0 else "Idle"
+
+            # Build metric document
+            try:
+                numeric_value = float(raw_value)
+            except:
+                numeric_value = None
+
+            metric_doc = {
+                "ts": int(time.time()),
+                "meta": {
+                    "device_id": dev,
+                    "hostid": hostid,
+                    "ifindex": group_name if not group_name.startswith("_") else None,
+                    "ifdescr": iface_label,
+                    "location": location_str,
+                    "geo": dict(geo),
+                    "device_status": "available",
+                    "data_age_seconds": age_seconds,
+                    "freshness": freshness
+                },
+                "metric": key or name,
+                "value": numeric_value if numeric_value is not None else raw_value,
+                "value_type": "counter" if traffic else "gauge"
+            }
+            metrics.append(metric_doc)
+
+            # Build event document
+            severity = "info"
+            labels = ["interface-up"]
+
+            if status == "Down":
+                severity = "critical"
+                labels = ["interface-down"]
+            elif status == "Idle":
+                severity = "warning"
+                labels = ["interface-idle"]
+
+            event_doc = {
+                "device_id": dev,
+                "hostid": hostid,
+                "iface": iface_label,
+                "metric": key or name,
+                "value": raw_value,
+                "status": status,
+                "severity": severity,
+                "detected_at": int(time.time()),
+                "location": location_str,
+                "evidence": {
+                    "rate_bps": rate_bps,
+                    "data_age_seconds": age_seconds,
+                    "freshness": freshness
+                },
+                "labels": labels
+            }
+            if should_emit_event(event_state, itemid, event_doc):
+                events.append(event_doc)
+
+            # Print status line
+            rate_str = f"rate_bps={rate_bps:.2f}" if rate_bps else "rate_bps=None"
+            print(f"[{dev}] {iface_label} - {name}: {raw_value} | {rate_str} | {freshness} -> {status}")
+
+    return metrics, events
 
 # ------------- main loop -------------
+def run_cycle(cache: dict, discovery: DiscoveryCache, sender: BackendSender):
+    """Run one discovery + collection + delivery cycle"""
+    STATS.begin_cycle()
+    # Discover all hosts (incrementally, see DiscoveryCache)
+    with STATS.phase("discovery"):
+        refresh_discovery(discovery)
+    all_hosts = discovery.hosts
+    catalog = discovery.catalog
+    print(f"\nDiscovered {len(all_hosts)} total devices from Zabbix.")
+
+    # Print summary of all devices
+    for h in all_hosts:
+        print(f"Device: {h.get('host', 'Unknown')} | HostID: {h.get('hostid', 'N/A')} | Status: {h.get('status', 'N/A')}")
+
+    # Filter network devices (the Zabbix server itself is never treated as one)
+    candidate_hosts = [h for h in all_hosts if not is_zabbix_server_host(h) and h.get("hostid")]
+
+    # Force update items for every host to get fresh data
+    with STATS.phase("force_update"):
+        map_hosts(lambda h: force_item_update(h["hostid"], known_items=catalog.items_for_host(h["hostid"])),
+                  candidate_hosts)
+
+    network_hosts = []
+    with STATS.phase("host_filter"):
+        for h in candidate_hosts:
+            hid = h["hostid"]
+            items_sample = get_items_for_host(hid, catalog=catalog)
+            if hid not in discovery.network_hostids:
+                discovery.network_hostids[hid] = is_network_host(items_sample)
+            if discovery.network_hostids[hid]:
+                network_hosts.append(h)
+                print(f"[ADDED] {h.get('host', '').lower()} as network device ({len(items_sample)} items)")
+
+    print(f"Found {len(network_hosts)} network devices.")
+
+    # Read current values of the known items of network devices only
+    with STATS.phase("item_values"):
+        refresh_item_values(catalog, [str(i["itemid"]) for h in network_hosts for i in catalog.items_for_host(h["hostid"])])
+
+    # Process each network device, streaming its documents to the backend as soon as it is done
+    def collect(nh: dict) -> Tuple[int, int]:
+        with STATS.phase("process_hosts"):
+            metrics, events = process_network_host(nh, discovery, cache)
+        STATS.record_host(nh.get("host"), len(catalog.items_for_host(nh["hostid"])), len(metrics), len(events))
+        sender.submit("metrics", BACKEND_METRICS_ENDPOINT, metrics)
+        sender.submit("events", BACKEND_EVENTS_ENDPOINT, events)
+        return len(metrics), len(events)
+
+    with STATS.phase("collect"):
+        counts = map_hosts(collect, network_hosts)
+
+    # Wait for the remaining chunks before ending the cycle
+    with STATS.phase("send_flush"):
+        sender.flush()
+    print(f"\n[BACKEND] Cycle produced {sum(c[0] for c in counts)} metrics and {sum(c[1] for c in counts)} events")
+
+    # An empty catalog after a failed first discovery says nothing about which items are gone
+    if discovery.refreshed_at:
+        prune_counter_cache(cache, catalog)
+        prune_event_state(cache, catalog)
+    summary = STATS.end_cycle()
+    if summary["overrun"]:
+        print(f"[STATS] Cycle overran POLL_INTERVAL: {summary['duration_seconds']}s > {POLL_INTERVAL}s")
+    if AGENT_STATS_FILE:
+        STATS.write_summary(AGENT_STATS_FILE)
+
 def main():
     if not API_TOKEN:
         print("ERROR: Set ZABBIX_API_TOKEN environment variable.")
         print("Example: export ZABBIX_API_TOKEN='your-zabbix-api-token-here'")
         sys.exit(1)
 
+    if SHARD_DIR and SHARD_WORKERS > 0:
+        print(f"[SHARD] Supervising {SHARD_WORKERS} workers in {SHARD_DIR}")
+        run_shard_supervisor(SHARD_WORKERS)
+        return
+
     cache = load_cache()
+    shard = ShardMembership(SHARD_DIR, SHARD_ID) if SHARD_DIR else None
+    discovery = DiscoveryCache(shard)
     
     # Test Zabbix connection first - apiinfo.version doesn't need auth
     test_payload = {"jsonrpc": "2.0", "method": "apiinfo.version", "params": {}, "id": 1}
     try:
-        r = requests.post(ZABBIX_URL, headers={"Content-Type": "application/json-rpc"}, 
-                         data=json.dumps(test_payload), timeout=10)
+        r = get_session("zabbix").post(ZABBIX_URL, headers={"Content-Type": "application/json-rpc"},
+                                       data=json.dumps(test_payload), timeout=10)
         r.raise_for_status()
         version_resp = r.json()
         if "result" in version_resp:
@@ -370,276 +1960,43 @@ def main():
     else:
         print("[SUCCESS] Zabbix API authentication successful")
 
-    while True:
-        all_metrics = []
-        all_events = []
+    print(f"[CONFIG] Host concurrency: {ZABBIX_MAX_CONCURRENCY}")
+    if AGENT_METRICS_PORT:
+        start_metrics_server(AGENT_METRICS_PORT)
 
-        # Discover all hosts
-        all_hosts = discover_hosts()
-        print(f"\nDiscovered {len(all_hosts)} total devices from Zabbix.")
-        
-        # Print summary of all devices
-        for h in all_hosts:
-            print(f"Device: {h.get('host', 'Unknown')} | HostID: {h.get('hostid', 'N/A')} | Status: {h.get('status', 'N/A')}")
-
-        # Filter network devices
-        network_hosts = []
-        zabbix_server_info = None
-        
-        for h in all_hosts:
-            hid = h.get("hostid")
-            hostname = h.get("host", "").lower()
-            
-            # Handle Zabbix server separately
-            if "zabbix" in hostname or "server" in hostname:
-                zabbix_server_info = {
-                    "hostid": hid,
-                    "hostname": h.get("host"),
-                    "name": h.get("name"),
-                    "interfaces": h.get("interfaces", []),
-                    "inventory": h.get("inventory", {})
-                }
-                continue
-                
-            if not hid:
-                continue
+    spool = IngestSpool(SPOOL_DIR) if SPOOL_DIR else None
+    if spool is not None and spool.has_pending():
+        print(f"[SPOOL] {spool.size_bytes()} bytes of undelivered batches will be replayed")
+    sender = BackendSender(spool=spool)
+    sender.start()
 
-            # Force update items for this host to get fresh data
-            force_item_update(hid)
-            
-            # Check for network-related items with relaxed criteria
-            items_sample = get_items_for_host(hid)
-            has_network_items = False
-            
-            if items_sample:
-                # Check if any items match network patterns
-                for item in items_sample:
-                    key = item.get("key_", "").lower()
-                    name = item.get("name", "").lower()
-                    
-                    # More permissive matching
-                    if any(term in key or term in name for term in ["if", "interface", "net", "traffic", "octets", "snmp"]):
-                        has_network_items = True
-                        break
-                    
-                    # Also check for router/switch specific patterns
-                    if any(pattern in name or pattern in key for pattern in ["fa0", "gi0", "eth", "cisco", "router", "switch"]):
-                        has_network_items = True
-                        break
-
-            if has_network_items or len(items_sample) > 10:  # If many items, likely a network device
-                network_hosts.append(h)
-                print(f"[ADDED] {hostname} as network device ({len(items_sample)} items)")
-
-        print(f"Found {len(network_hosts)} network devices.")
-
-        # Process each network device
-        for nh in network_hosts:
-            hostid = nh.get("hostid")
-            dev = nh.get("host")
-            interfaces = nh.get("interfaces") or []
-            ip_for_geo = interfaces[0].get("ip") if interfaces else None
-            
-            print(f"\n[PROCESSING] {dev} (HostID: {hostid})")
-            
-            # Get all items for this host (including those without recent checks)
-            items = get_items_for_host(hostid, include_all=True)
-            if not items:
-                print(f"[{dev}] No items found at all.")
-                continue
+    # Exit through the finally below so the sender is drained and leave() runs
+    exit_on_signals()
 
-            print(f"[{dev}] Found {len(items)} total items")
-
-            # Show sample of items for debugging
-            print(f"[{dev}] Sample items:")
-            for i, item in enumerate(items[:10]):
-                status = "Enabled" if int(item.get("status", 1)) == 0 else "Disabled"
-                lastclock = item.get("lastclock")
-                age = "Never" if not lastclock else f"{int(time.time()) - int(lastclock)}s ago"
-                print(f"  {i+1}. {item.get('name', 'N/A')[:50]} | Status: {status} | Last: {age}")
-
-            # Filter for network items
-            network_items = []
-            for item in items:
-                key = item.get("key_", "").lower()
-                name = item.get("name", "").lower()
-                
-                if ALL_ITEMS:
-                    network_items.append(item)
-                else:
-                    # Enhanced matching for network items
-                    is_network_item = (
-                        any(term in key or term in name for term in NETWORK_ITEM_TERMS) or
-                        any(pattern in name or pattern in key for pattern in ["fa0", "gi0", "eth", "port", "link"]) or
-                        re.search(r'interface|if\w*\[|octets|traffic|bandwidth', key + name, re.I)
-                    )
-                    
-                    if is_network_item:
-                        network_items.append(item)
-
-            print(f"[{dev}] Found {len(network_items)} network items")
-
-            if len(network_items) == 0:
-                print(f"[{dev}] No network items found. Skipping.")
-                continue
+    if shard is not None:
+        shard.start()
+        print(f"[SHARD] {SHARD_ID} joined {SHARD_DIR} ({len(shard.members)} members)")
 
-            # Dynamically discover interface groupings
-            interface_groups = discover_interfaces_dynamically(network_items)
-            
-            print(f"[{dev}] Discovered interface groups: {list(interface_groups.keys())}")
-
-            # Get interface descriptions mapping
-            ifdescr_map = get_ifdescr_map(hostid)
-
-            # Process each interface group
-            for group_name, group_items in interface_groups.items():
-                if group_name == "_system":
-                    iface_label = "System"
-                elif group_name == "_other":
-                    iface_label = "Other"
-                elif group_name.startswith("if_"):
-                    idx = group_name[3:]
-                    iface_label = ifdescr_map.get(idx, f"Interface {idx}")
-                else:
-                    iface_label = group_name
-
-                # Process each item in the group
-                for item in group_items:
-                    itemid = str(item.get("itemid"))
-                    key = item.get("key_") or ""
-                    name = item.get("name") or key
-                    raw_value = item.get("lastvalue")
-                    lastclock = item.get("lastclock")
-                    
-                    # Skip items with no value
-                    if raw_value is None or raw_value == "":
-                        print(f"[{dev}] {iface_label} - {name}: No data available")
-                        continue
+    try:
+        while True:
+            cycle_start = time.time()
+            run_cycle(cache, discovery, sender)
 
-                    # Determine data freshness
-                    age_seconds = 0
-                    if lastclock:
-                        age_seconds = int(time.time()) - int(lastclock)
-                    
-                    freshness = "Fresh" if age_seconds < 300 else f"Stale ({age_seconds}s)"
-                    
-                    # Calculate rate for traffic items
-                    rate_bps = None
-                    is_traffic_item = any(term in name.lower() or term in key.lower() 
-                                        for term in ["in", "out", "octets", "traffic", "bandwidth"])
-                    
-                    if is_traffic_item:
-                        # Try to get rate from history
-                        hist = history_last_two(itemid, value_type=int(item.get("value_type", 3)))
-                        if hist and len(hist) >= 2:
-                            try:
-                                new_v = float(hist[0]["value"])
-                                old_v = float(hist[1]["value"])
-                                new_ts = int(hist[0]["clock"])
-                                old_ts = int(hist[1]["clock"])
-                                maxc = guess_counter_max(key)
-                                bps = safe_compute_rate(old_v, old_ts, new_v, new_ts, maxc)
-                                if bps is not None:
-                                    rate_bps = bps * 8.0  # Convert to bits per second
-                            except Exception as e:
-                                print(f"[{dev}] Rate calculation error for {name}: {e}")
-
-                    # Determine status
-                    status = "Up"  # Default
-                    if "status" in name.lower() and "oper" in name.lower():
-                        status = "Up" if oper_status_is_up(raw_value) else "Down"
-                    elif is_traffic_item and rate_bps is not None:
-                        status = "Active" if rate_bps > 0 else "Idle"
-
-                    # Build metric document
-                    try:
-                        numeric_value = float(raw_value)
-                    except:
-                        numeric_value = None
-
-                    # Geo location handling
-                    raw_inventory = nh.get("inventory", {})
-                    location_str = "Unknown Location"
-                    geo = {"lat": None, "lon": None, "source": "unknown"}
-                    
-                    if isinstance(raw_inventory, dict):
-                        location_str = raw_inventory.get("location", "Unknown Location")
-                        if raw_inventory.get("location_lat"):
-                            geo["lat"] = float(raw_inventory["location_lat"])
-                        if raw_inventory.get("location_lon"):
-                            geo["lon"] = float(raw_inventory["location_lon"])
-                        if geo["lat"] and geo["lon"]:
-                            geo["source"] = "zabbix_inventory"
-
-                    metric_doc = {
-                        "ts": int(time.time()),
-                        "meta": {
-                            "device_id": dev,
-                            "hostid": hostid,
-                            "ifindex": group_name if not group_name.startswith("_") else None,
-                            "ifdescr": iface_label,
-                            "location": location_str,
-                            "geo": geo,
-                            "device_status": "available",
-                            "data_age_seconds": age_seconds,
-                            "freshness": freshness
-                        },
-                        "metric": key or name,
-                        "value": numeric_value if numeric_value is not None else raw_value,
-                        "value_type": "counter" if is_traffic_item else "gauge"
-                    }
-                    all_metrics.append(metric_doc)
-
-                    # Build event document
-                    severity = "info"
-                    labels = ["interface-up"]
-                    
-                    if status == "Down":
-                        severity = "critical"
-                        labels = ["interface-down"]
-                    elif status == "Idle":
-                        severity = "warning" 
-                        labels = ["interface-idle"]
-
-                    event_doc = {
-                        "device_id": dev,
-                        "hostid": hostid,
-                        "iface": iface_label,
-                        "metric": key or name,
-                        "value": raw_value,
-                        "status": status,
-                        "severity": severity,
-                        "detected_at": int(time.time()),
-                        "location": location_str,
-                        "evidence": {
-                            "rate_bps": rate_bps,
-                            "data_age_seconds": age_seconds,
-                            "freshness": freshness
-                        },
-                        "labels": labels
-                    }
-                    all_events.append(event_doc)
-
-                    # Print status line
-                    rate_str = f"rate_bps={rate_bps:.2f}" if rate_bps else "rate_bps=None"
-                    print(f"[{dev}] {iface_label} - {name}: {raw_value} | {rate_str} | {freshness} -> {status}")
-
-        # Send bulk data to backend
-        if BACKEND_METRICS_ENDPOINT and all_metrics:
-            print(f"\n[BACKEND] Sending {len(all_metrics)} metrics...")
-            ok, resp = post_with_retries(BACKEND_METRICS_ENDPOINT, all_metrics)
-            print(f"[BACKEND] Metrics posted: {ok} - {resp[:100] if resp else 'No response'}")
-            
-        if BACKEND_EVENTS_ENDPOINT and all_events:
-            print(f"[BACKEND] Sending {len(all_events)} events...")
-            ok, resp = post_with_retries(BACKEND_EVENTS_ENDPOINT, all_events)
-            print(f"[BACKEND] Events posted: {ok} - {resp[:100] if resp else 'No response'}")
-
-        # Save cache
-        save_cache(cache)
-        print(f"\nCycle complete. Sleeping {POLL_INTERVAL}s...")
-        print("=" * 80)
-        time.sleep(POLL_INTERVAL)
+            # Save cache
+            save_cache(cache)
+            print(f"\nCycle complete in {time.time() - cycle_start:.1f}s. Sleeping {POLL_INTERVAL}s...")
+            print("=" * 80)
+            time.sleep(POLL_INTERVAL)
+    finally:
+        try:
+            pending = sender.queue.qsize()
+            if pending:
+                where = "spool" if spool is not None else "backend"
+                print(f"[BACKEND] Handing {pending} queued chunks to the {where} before exit")
+            sender.close()
+        finally:
+            if shard is not None:
+                shard.leave()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
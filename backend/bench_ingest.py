@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+bench_ingest.py
+- Measures backend ingest CPU cost per request body, without MongoDB
+- Compares the model path (json + MetricIn/EventIn per item) with the fast path
+  (orjson when installed + single-pass validation + bulk ts conversion)
+
+Usage: python bench_ingest.py [points_per_request] [requests]
+"""
+
+import sys
+import time
+import json
+import random
+
+import main
+
+def make_metrics(n: int, hosts: int = 20) -> list:
+    """Metric documents shaped like the ones the agent builds"""
+    now = int(time.time())
+    docs = []
+    for i in range(n):
+        h = i % hosts
+        idx = (i // hosts) % 48 + 1
+        docs.append({
+            "ts": now,
+            "meta": {
+                "device_id": f"switch-{h:03d}",
+                "hostid": str(10000 + h),
+                "ifindex": f"if_{idx}",
+                "ifdescr": f"GigabitEthernet0/{idx}",
+                "location": f"Office {h % 5}",
+                "geo": {"lat": 19.07, "lon": 72.87, "source": "zabbix_inventory"},
+                "device_status": "available",
+                "data_age_seconds": random.randint(0, 60),
+                "freshness": "Fresh"
+            },
+            "metric": f"net.if.in[ifHCInOctets.{idx}]",
+            "value": float(random.randint(0, 10**12)),
+            "value_type": "counter"
+        })
+    return docs
+
+def make_events(n: int, hosts: int = 20) -> list:
+    now = int(time.time())
+    return [{
+        "device_id": f"switch-{i % hosts:03d}",
+        "hostid": str(10000 + i % hosts),
+        "iface": f"GigabitEthernet0/{i % 48 + 1}",
+        "metric": f"net.if.status[ifOperStatus.{i % 48 + 1}]",
+        "value": "1",
+        "status": "Up",
+        "severity": "info",
+        "detected_at": now,
+        "location": f"Office {i % 5}",
+        "evidence": {"rate_bps": None, "data_age_seconds": 10, "freshness": "Fresh"},
+        "labels": ["interface-up"]
+    } for i in range(n)]
+
+def bench(name: str, fn, body: bytes, points: int, rounds: int) -> float:
+    fn(body)  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(body)
+    elapsed = time.perf_counter() - start
+    rate = points * rounds / elapsed
+    print(f"  {name:<12} {rate:>12,.0f} points/s  ({elapsed / rounds * 1000:.1f} ms per request)")
+    return rate
+
+def main_bench():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"Ingest parse/validate benchmark: {points} points per request, {rounds} requests")
+    print(f"orjson: {'yes' if main.orjson else 'no (stdlib json)'}")
+
+    metrics_body = json.dumps(make_metrics(points)).encode("utf-8")
+    events_body = json.dumps(make_events(points)).encode("utf-8")
+
+    print("/ingest/metrics")
+    before = bench("model path", lambda b: main.prepare_metric_docs(json.loads(b)), metrics_body, points, rounds)
+    after = bench("fast path", lambda b: main.validate_metrics_fast(main.json_loads(b)), metrics_body, points, rounds)
+    print(f"  speedup      {after / before:.1f}x")
+
+    print("/ingest/events")
+    before = bench("model path", lambda b: main.prepare_event_docs(json.loads(b)), events_body, points, rounds)
+    after = bench("fast path", lambda b: main.validate_events_fast(main.json_loads(b)), events_body, points, rounds)
+    print(f"  speedup      {after / before:.1f}x")
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+load_test.py
+- Load harness for a running backend (uvicorn main:app) backed by a local mongod
+- Replays agent-shaped metric/event batches against /ingest/metrics and /ingest/events at a
+  target request rate with many concurrent clients (open loop, keep-alive connections)
+- Runs a mixed read load on /metrics, /devices/with-interfaces, /admin/stats and /latest
+- Reports per endpoint throughput, errors and p50/p95/p99 latency; optional JSON output
+- Latency is measured from each request's scheduled send time, so queueing behind a slow
+  server shows up in the percentiles instead of lowering the achieved rate only
+
+Usage: python load_test.py --url http://localhost:8000 --duration 60 --ingest-rate 20 --read-rate 50
+       python load_test.py --drop --db netmon_bench   # empty the backend's collections (needs pymongo, MONGO_URL)
+Only the standard library is needed unless --drop is used.
+"""
+
+import os
+import sys
+import time
+import json
+import gzip
+import random
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse, urlencode
+from typing import Optional, Dict, List, Tuple
+
+try:
+    import pymongo  # optional, only for --drop
+except ImportError:
+    pymongo = None
+
+# ------------- agent-shaped payloads -------------
+class Fleet:
+    """Synthetic devices producing documents shaped like the agent's metric_doc / event_doc"""
+
+    def __init__(self, devices: int, interfaces: int, seed: int = 1):
+        rnd = random.Random(seed)
+        self.devices = [{
+            "device_id": f"load-sw-{d:04d}",
+            "hostid": str(20000 + d),
+            "location": f"Load Office {d % 10}",
+            "geo": {"lat": 19.0 + d % 10 / 10, "lon": 72.8 + d % 10 / 10, "source": "zabbix_inventory"},
+            "counters": [rnd.randrange(2 ** 40) for _ in range(interfaces)]
+        } for d in range(devices)]
+        self.interfaces = interfaces
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def next_devices(self, count: int) -> List[dict]:
+        with self.lock:
+            out = [self.devices[(self.cursor + i) % len(self.devices)] for i in range(count)]
+            self.cursor = (self.cursor + count) % len(self.devices)
+        return out
+
+    def metrics(self, docs: int) -> List[dict]:
+        """About `docs` metric documents: 3 per interface (in, out, status), whole devices at a time"""
+        per_device = self.interfaces * 3
+        now = int(time.time())
+        out = []
+        for dev in self.next_devices(max(1, docs // per_device)):
+            for i in range(self.interfaces):
+                idx = i + 1
+                dev["counters"][i] += random.randint(10 ** 5, 10 ** 8)
+                meta = {
+                    "device_id": dev["device_id"],
+                    "hostid": dev["hostid"],
+                    "ifindex": f"if_{idx}",  # same form as the agent's interface groups
+                    "ifdescr": f"GigabitEthernet0/{idx}",
+                    "location": dev["location"],
+                    "geo": dict(dev["geo"]),
+                    "device_status": "available",
+                    "data_age_seconds": random.randint(0, 60),
+                    "freshness": "Fresh"
+                }
+                out.append({"ts": now, "meta": meta, "metric": f"ifHCInOctets[{idx}]",
+                            "value": float(random.randint(0, 10 ** 9)), "value_type": "counter"})
+                out.append({"ts": now, "meta": dict(meta), "metric": f"ifHCOutOctets[{idx}]",
+                            "value": float(random.randint(0, 10 ** 9)), "value_type": "counter"})
+                out.append({"ts": now, "meta": dict(meta), "metric": f"ifOperStatus[{idx}]",
+                            "value": 1.0, "value_type": "gauge"})
+        return out
+
+    def events(self, docs: int) -> List[dict]:
+        now = int(time.time())
+        out = []
+        for _ in range(docs):
+            dev = random.choice(self.devices)
+            idx = random.randint(1, self.interfaces)
+            status, severity, labels = random.choice([("Up", "info", ["interface-up"]),
+                                                      ("Down", "critical", ["interface-down"]),
+                                                      ("Idle", "warning", ["interface-idle"])])
+            out.append({
+                "device_id": dev["device_id"],
+                "hostid": dev["hostid"],
+                "iface": f"GigabitEthernet0/{idx}",
+                "metric": f"ifOperStatus[{idx}]",
+                "value": "1" if status != "Down" else "2",
+                "status": status,
+                "severity": severity,
+                "detected_at": now,
+                "location": dev["location"],
+                "evidence": {"rate_bps": random.random() * 1e6, "data_age_seconds": 10, "freshness": "Fresh"},
+                "labels": labels
+            })
+        return out
+
+# ------------- measurements -------------
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[int, int]] = {}
+        self.docs: Dict[str, int] = {}
+        self.late: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float, status: int, docs: int = 0, late: bool = False):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            codes = self.statuses.setdefault(name, {})
+            codes[status] = codes.get(status, 0) + 1
+            if not 200 <= status < 300:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            else:
+                self.docs[name] = self.docs.get(name, 0) + docs
+            if late:
+                self.late[name] = self.late.get(name, 0) + 1
+
+    @staticmethod
+    def percentile(values: List[float], p: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        out = {}
+        with self.lock:
+            for name, lat in sorted(self.latencies.items()):
+                out[name] = {
+                    "requests": len(lat),
+                    "errors": self.errors.get(name, 0),
+                    "late": self.late.get(name, 0),
+                    "req_per_s": round(len(lat) / elapsed, 2),
+                    "docs_per_s": round(self.docs.get(name, 0) / elapsed, 1),
+                    "p50_ms": round(self.percentile(lat, 50) * 1000, 2),
+                    "p95_ms": round(self.percentile(lat, 95) * 1000, 2),
+                    "p99_ms": round(self.percentile(lat, 99) * 1000, 2),
+                    "max_ms": round(max(lat) * 1000, 2),
+                    "statuses": {str(k): v for k, v in sorted(self.statuses.get(name, {}).items())}
+                }
+        return out
+
+# ------------- HTTP client -------------
+class Client:
+    """One keep-alive connection per worker thread"""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.conn: Optional[http.client.HTTPConnection] = None
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> Tuple[int, bytes]:
+        for attempt in (1, 2):
+            if self.conn is None:
+                cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+                self.conn = cls(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                resp = self.conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    return 599, b""
+        return 599, b""
+
+def encode(payload, use_gzip: bool) -> Tuple[bytes, dict]:
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if use_gzip:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+# ------------- workers -------------
+def paced(rate: float, deadline: float, stop: threading.Event):
+    """Yield (scheduled_time, late) at `rate` per second until deadline (open loop)"""
+    if rate <= 0:
+        return
+    interval = 1.0 / rate
+    next_at = time.perf_counter() + random.random() * interval
+    while not stop.is_set():
+        now = time.perf_counter()
+        if next_at > deadline:
+            return
+        if next_at > now:
+            time.sleep(next_at - now)
+        yield next_at, time.perf_counter() - next_at > interval
+        next_at += interval
+
+def ingest_worker(args, fleet: Fleet, rec: Recorder, kind: str, rate: float, deadline: float, stop: threading.Event):
+    client = Client(args.url)
+    path = f"/ingest/{kind}"
+
+    def build():
+        docs = fleet.metrics(args.batch) if kind == "metrics" else fleet.events(args.event_batch)
+        return docs, encode(docs, args.gzip)
+
+    # Build the next batch ahead of its slot so encoding is not counted as server latency
+    docs, (body, headers) = build()
+    for scheduled, late in paced(rate, deadline, stop):
+        status, _ = client.request("POST", path, body, headers)
+        rec.record(f"POST {path}", time.perf_counter() - scheduled, status, len(docs), late)
+        docs, (body, headers) = build()
+
+def read_worker(args, fleet: Fleet, rec: Recorder, rate: float, deadline: float, stop: threading.Event):
+    client = Client(args.url)
+    routes = [("metrics", args.read_weights[0]), ("devices", args.read_weights[1]),
+              ("stats", args.read_weights[2]), ("latest", args.read_weights[3])]
+    names, weights = zip(*routes)
+    for scheduled, late in paced(rate, deadline, stop):
+        route = random.choices(names, weights)[0]
+        dev = random.choice(fleet.devices)
+        if route == "metrics":
+            now = int(time.time())
+            params = {"device_id": dev["device_id"], "metric": f"ifHCInOctets[{random.randint(1, fleet.interfaces)}]",
+                      "start_ts": now - args.read_window, "end_ts": now}
+            if random.random() < 0.5:
+                params["max_points"] = 200
+            name, path = "GET /metrics", "/metrics?" + urlencode(params)
+        elif route == "devices":
+            name = "GET /devices/with-interfaces"
+            path = "/devices/with-interfaces" + ("?" + urlencode({"office": dev["location"]}) if random.random() < 0.5 else "")
+        elif route == "stats":
+            name, path = "GET /admin/stats", "/admin/stats"
+        else:
+            name, path = "GET /latest", "/latest?" + urlencode({"device_id": dev["device_id"]})
+        status, _ = client.request("GET", path)
+        rec.record(name, time.perf_counter() - scheduled, status, late=late)
+
+def backend_collections() -> List[str]:
+    """Collections main.py creates, under the same env overrides"""
+    metrics = os.environ.get("METRICS_COLL", "metrics_ts")
+    return ([metrics] + [f"{metrics}_{r}" for r in ("1m", "5m", "1h")] +
+            [os.environ.get("EVENTS_COLL", "events"), os.environ.get("DEVICES_COLL", "devices")])
+
+def drop_collections(db_name: str):
+    if pymongo is None:
+        sys.exit("--drop needs pymongo (pip install -r requirements.txt)")
+    mongo = pymongo.MongoClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017/"))
+    db = mongo[db_name]
+    existing = set(db.list_collection_names())
+    dropped = [name for name in backend_collections() if name in existing]
+    for name in dropped:
+        db.drop_collection(name)
+    print(f"Dropped {', '.join(dropped) or 'nothing'} in {db.name}; restart the backend so it recreates them")
+
+def run_phase(args, fleet: Fleet, duration: float) -> Tuple[Recorder, float]:
+    rec = Recorder()
+    stop = threading.Event()
+    deadline = time.perf_counter() + duration
+    threads = []
+    plan = [("metrics", args.ingest_rate, args.ingest_clients),
+            ("events", args.ingest_rate * args.events_ratio, max(1, args.ingest_clients // 4))]
+    for kind, rate, clients in plan:
+        if rate <= 0:
+            continue
+        for _ in range(clients):
+            threads.append(threading.Thread(target=ingest_worker, daemon=True,
+                                            args=(args, fleet, rec, kind, rate / clients, deadline, stop)))
+    if args.read_rate > 0:
+        for _ in range(args.read_clients):
+            threads.append(threading.Thread(target=read_worker, daemon=True,
+                                            args=(args, fleet, rec, args.read_rate / args.read_clients, deadline, stop)))
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for t in threads:
+            t.join()
+    return rec, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend ingest/query load harness")
+    parser.add_argument("--url", default=os.environ.get("BACKEND_URL", "http://localhost:8000"))
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds first (fills data for reads)")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--interfaces", type=int, default=24)
+    parser.add_argument("--ingest-rate", type=float, default=10.0, help="/ingest/metrics requests per second")
+    parser.add_argument("--ingest-clients", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=1000, help="metric documents per request (whole devices)")
+    parser.add_argument("--events-ratio", type=float, default=0.2, help="/ingest/events requests per metrics request")
+    parser.add_argument("--event-batch", type=int, default=50)
+    parser.add_argument("--read-rate", type=float, default=20.0, help="read requests per second")
+    parser.add_argument("--read-clients", type=int, default=8)
+    parser.add_argument("--read-mix", default="60,15,10,15",
+                        help="weights for /metrics,/devices/with-interfaces,/admin/stats,/latest")
+    parser.add_argument("--read-window", type=int, default=3600, help="/metrics time range in seconds")
+    parser.add_argument("--gzip", action="store_true", help="gzip request bodies")
+    parser.add_argument("--drop", action="store_true",
+                        help="drop the backend's collections in --db and exit (needs pymongo)")
+    parser.add_argument("--db", help="database for --drop; required, use a dedicated bench database")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    args.read_weights = [float(w) for w in args.read_mix.split(",")]
+    if len(args.read_weights) != 4:
+        parser.error("--read-mix needs four weights")
+
+    random.seed(args.seed)
+    if args.drop:
+        if not args.db:
+            parser.error("--drop needs an explicit --db (the backend database the load test writes to)")
+        drop_collections(args.db)
+        return
+
+    status, _ = Client(args.url).request("GET", "/admin/stats")
+    if status != 200:
+        sys.exit(f"Backend not reachable at {args.url} (GET /admin/stats -> {status})")
+
+    fleet = Fleet(args.devices, args.interfaces, args.seed)
+    print(f"Load test against {args.url}: {args.devices} devices x {args.interfaces} interfaces, "
+          f"ingest {args.ingest_rate}/s x {args.batch} docs, reads {args.read_rate}/s, {args.duration}s")
+    if args.warmup > 0:
+        print(f"Warm-up {args.warmup}s...")
+        run_phase(args, fleet, args.warmup)
+    rec, elapsed = run_phase(args, fleet, args.duration)
+    report = rec.report(elapsed)
+
+    print(f"\n{'endpoint':<32} {'req':>7} {'err':>5} {'late':>5} {'req/s':>8} {'docs/s':>10} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, r in report.items():
+        print(f"{name:<32} {r['requests']:>7} {r['errors']:>5} {r['late']:>5} {r['req_per_s']:>8} {r['docs_per_s']:>10} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}")
+    late = sum(r["late"] for r in report.values())
+    if late:
+        print(f"\n{late} requests started behind schedule: the clients could not hold the target rate")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "elapsed": elapsed, "report": report}, f, indent=1)
+
+if __name__ == "__main__":
+    main()
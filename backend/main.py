@@ -1,84 +1,307 @@
 # backend/main.py
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel, Field
-from typing import List, Optional, Any, Dict
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Any, Dict, Callable
 from motor.motor_asyncio import AsyncIOMotorClient
-import os, time, datetime, asyncio
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+import os, re, time, datetime, asyncio, gzip, json, contextlib
+
+try:
+    import msgpack  # optional, needed only for msgpack-encoded compact batches
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson  # optional, faster JSON decoding of ingest bodies
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_loads = json.loads
 
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017/")
 DB_NAME = os.environ.get("DB_NAME", "netmon")
 METRICS_COLL = os.environ.get("METRICS_COLL", "metrics_ts")
 EVENTS_COLL = os.environ.get("EVENTS_COLL", "events")
+# One document per (device_id, ifindex), upserted at ingest when the interface first appears or changes
+DEVICES_COLL = os.environ.get("DEVICES_COLL", "devices")
+# Unchanged inventory rows are re-stamped this often; rows not seen for METRICS_EXPIRE_DAYS expire
+INVENTORY_TOUCH_SECONDS = int(os.environ.get("INVENTORY_TOUCH_SECONDS", "86400"))
 
 # Cleanup configuration
 CLEANUP_ENABLED = os.environ.get("CLEANUP_ENABLED", "true").lower() == "true"
 CLEANUP_INTERVAL_HOURS = int(os.environ.get("CLEANUP_INTERVAL_HOURS", "24"))
 KEEP_DAYS = int(os.environ.get("KEEP_DAYS", "7"))
 MIN_RECORDS_PER_DEVICE = int(os.environ.get("MIN_RECORDS_PER_DEVICE", "100"))
+# Hard ceiling enforced by the time-series collection itself (expireAfterSeconds). It defaults to
+# KEEP_DAYS when no per-device minimum is kept, otherwise to a longer horizon so quiet devices
+# keep their last MIN_RECORDS_PER_DEVICE points until then.
+METRICS_EXPIRE_DAYS = int(os.environ.get("METRICS_EXPIRE_DAYS",
+                                         str(KEEP_DAYS if MIN_RECORDS_PER_DEVICE <= 0 else KEEP_DAYS * 4)))
+
+# Rollups: 1m/5m/1h aggregates per (device_id, metric), maintained at ingest time
+ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "true").lower() == "true"
+ROLLUP_RESOLUTIONS = [
+    ("1m", 60, int(os.environ.get("ROLLUP_1M_KEEP_DAYS", "14"))),
+    ("5m", 300, int(os.environ.get("ROLLUP_5M_KEEP_DAYS", "90"))),
+    ("1h", 3600, int(os.environ.get("ROLLUP_1H_KEEP_DAYS", "730")))
+]
+# Expected spacing of raw points (the agent POLL_INTERVAL), used to estimate raw point counts
+RAW_INTERVAL_SECONDS = int(os.environ.get("RAW_INTERVAL_SECONDS", "30"))
+# Upper bound on raw points scanned for LTTB downsampling of a single series
+LTTB_MAX_SCAN = int(os.environ.get("LTTB_MAX_SCAN", "200000"))
+
+# /admin/stats is served from collection metadata and cached this long
+STATS_CACHE_SECONDS = float(os.environ.get("STATS_CACHE_SECONDS", "30"))
+
+# Latest-value table is warmed from this much recent history at startup
+LATEST_WARM_SECONDS = int(os.environ.get("LATEST_WARM_SECONDS", "3600"))
+
+# Live stream (/stream): batches queued per subscriber before new ones are dropped, and keep-alive period
+STREAM_QUEUE_MAX = int(os.environ.get("STREAM_QUEUE_MAX", "256"))
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", "15"))
+
+# Fast ingest: single-pass validation without per-item Pydantic models and unordered bulk inserts
+INGEST_FAST_PATH = os.environ.get("INGEST_FAST_PATH", "false").lower() == "true"
+
+# Write coalescing: ingest answers 202 and documents are flushed in large batches
+WRITE_BUFFER_ENABLED = os.environ.get("WRITE_BUFFER_ENABLED", "false").lower() == "true"
+WRITE_BUFFER_MAX_DOCS = int(os.environ.get("WRITE_BUFFER_MAX_DOCS", "200000"))
+WRITE_BUFFER_FLUSH_DOCS = int(os.environ.get("WRITE_BUFFER_FLUSH_DOCS", "5000"))
+WRITE_BUFFER_FLUSH_MS = int(os.environ.get("WRITE_BUFFER_FLUSH_MS", "500"))
+WRITE_BUFFER_WAIT_SECONDS = float(os.environ.get("WRITE_BUFFER_WAIT_SECONDS", "2"))
 
 client = AsyncIOMotorClient(MONGO_URL)
 db = client[DB_NAME]
 
+# ---------- gzip request bodies ----------
+class GzipRequest(Request):
+    """Request whose body is transparently gunzipped when sent with Content-Encoding: gzip"""
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            if "gzip" in self.headers.getlist("Content-Encoding"):
+                try:
+                    body = gzip.decompress(body)
+                except OSError:
+                    raise HTTPException(400, "Invalid gzip request body")
+            self._body = body
+        return self._body
+
+class GzipRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            request = GzipRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return custom_route_handler
+
+# ---------- Internal instrumentation ----------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 100, 500, 1000, 5000, 10000, 50000)
+
+class Instruments:
+    """Counters, gauges and histograms rendered in Prometheus text format.
+
+    Everything runs on the event loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.counters: Dict[tuple, float] = {}
+        self.gauges: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, dict] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, labels: Dict[str, Any], amount: float = 1):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, labels: Dict[str, Any], value: float):
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, labels: Dict[str, Any], value: float, buckets: tuple = LATENCY_BUCKETS):
+        key = self._key(name, labels)
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(h["buckets"]):
+            if value <= bound:
+                h["counts"][i] += 1
+        h["sum"] += value
+        h["count"] += 1
+
+    @contextlib.contextmanager
+    def mongo_op(self, op: str, coll: str):
+        """Time a Mongo call (including cursor iteration when it is inside the block)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("backend_mongo_op_seconds", {"op": op, "collection": coll}, time.perf_counter() - start)
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = "") -> str:
+        def esc(v: str) -> str:
+            return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts = [f'{k}="{esc(v)}"' for k, v in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines = []
+        for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+            typed = set()
+            for (name, labels), value in sorted(series.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        typed = set()
+        for (name, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, n in zip(list(h["buckets"]) + ["+Inf"], h["counts"] + [h["count"]]):
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{self._labels(labels, le)} {n}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h['sum']:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+INSTRUMENTS = Instruments()
+
 app = FastAPI(title="NetMon Ingest API")
+app.router.route_class = GzipRoute
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        INSTRUMENTS.observe("backend_request_seconds", {
+            "method": request.method,
+            "route": route.path if route is not None else "unmatched",
+            "status": f"{status // 100}xx"
+        }, time.perf_counter() - start)
+
+# ---------- Retention ----------
+async def estimated_count(coll_name: str) -> Optional[int]:
+    """Document count from collection metadata (never scans the collection)"""
+    try:
+        return await db[coll_name].estimated_document_count()
+    except Exception:
+        pass
+    try:
+        # Time-series collections are views; ask the storage stats instead
+        async for stats in db[coll_name].aggregate([{"$collStats": {"count": {}}}]):
+            return stats.get("count")
+    except Exception:
+        pass
+    return None
+
+async def ensure_retention():
+    """Configure native expiry: time-series expireAfterSeconds and a TTL index on events.detected_at"""
+    try:
+        await db.command({"collMod": METRICS_COLL, "expireAfterSeconds": METRICS_EXPIRE_DAYS * 86400})
+    except Exception as e:
+        print("Warning: could not set metrics expireAfterSeconds:", e)
+    try:
+        await db[EVENTS_COLL].create_index([("detected_at", 1)], name="detected_at_ttl",
+                                           expireAfterSeconds=KEEP_DAYS * 86400)
+    except Exception:
+        # Index exists with another expiry: update it in place
+        try:
+            await db.command({"collMod": EVENTS_COLL,
+                              "index": {"name": "detected_at_ttl", "expireAfterSeconds": KEEP_DAYS * 86400}})
+        except Exception as e:
+            print("Warning: could not set events TTL index:", e)
+
+async def enforce_retention(keep_days: int, min_records: int) -> dict:
+    """Delete data older than keep_days while keeping the newest min_records points per device.
+
+    Bulk expiry is left to MongoDB. Devices are listed from the inventory
+    (DEVICES_COLL), and this pass only touches devices whose oldest
+    point is past the cutoff, and for those it walks at most min_records
+    entries of the (meta.device_id, ts) index to find where the kept tail begins.
+    """
+    run_start = time.perf_counter()
+    cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)
+    metrics = db[METRICS_COLL]
+
+    total_metrics_deleted = 0
+    # Device ids come from the small inventory collection, not a scan of the metrics
+    devices = await db[DEVICES_COLL].distinct("device_id")
+    for device_id in devices:
+        oldest = await metrics.find_one({"meta.device_id": device_id}, {"ts": 1}, sort=[("ts", 1)])
+        if not oldest or oldest["ts"] >= cutoff_time:
+            continue
+
+        threshold_time = cutoff_time
+        if min_records > 0:
+            # Timestamp of the Nth most recent record
+            keep_threshold = await metrics.find(
+                {"meta.device_id": device_id}, {"ts": 1}
+            ).sort("ts", -1).skip(min_records - 1).limit(1).to_list(1)
+            if not keep_threshold:
+                continue  # fewer than min_records points in total
+            threshold_time = min(cutoff_time, keep_threshold[0]["ts"])
+
+        result = await metrics.delete_many({
+            "meta.device_id": device_id,
+            "ts": {"$lt": threshold_time}
+        })
+        total_metrics_deleted += result.deleted_count
+
+    # Events normally expire through the TTL index; this catches a shorter keep_days
+    events_result = await db[EVENTS_COLL].delete_many({
+        "detected_at": {"$lt": cutoff_time}
+    })
+
+    stats_cache["at"] = 0.0  # counts changed; next /admin/stats recomputes
+    INSTRUMENTS.inc("backend_cleanup_runs_total", {})
+    INSTRUMENTS.set("backend_cleanup_last_duration_seconds", {}, time.perf_counter() - run_start)
+    for coll, deleted in (("metrics", total_metrics_deleted), ("events", events_result.deleted_count)):
+        INSTRUMENTS.inc("backend_cleanup_deleted_total", {"collection": coll}, deleted)
+        INSTRUMENTS.set("backend_cleanup_last_deleted", {"collection": coll}, deleted)
+    return {
+        "deleted": {"metrics": total_metrics_deleted, "events": events_result.deleted_count},
+        "devices": len(devices),
+        "cutoff_time": cutoff_time
+    }
 
-# ---------- Cleanup functions ----------
 async def cleanup_old_data():
     """Clean up old metrics and events data"""
     try:
         print(f"🧹 Starting automatic cleanup (keep {KEEP_DAYS} days, min {MIN_RECORDS_PER_DEVICE} records per device)")
         
-        # Calculate cutoff timestamp
-        cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(days=KEEP_DAYS)
-        
         # Get current stats
-        metrics_count = await db[METRICS_COLL].count_documents({})
-        events_count = await db[EVENTS_COLL].count_documents({})
+        metrics_count = await estimated_count(METRICS_COLL)
+        events_count = await estimated_count(EVENTS_COLL)
         
         print(f"📊 Before cleanup: {metrics_count} metrics, {events_count} events")
         
-        # Cleanup metrics
-        devices = await db[METRICS_COLL].distinct("meta.device_id")
-        total_metrics_deleted = 0
-        
-        for device_id in devices:
-            device_metrics_count = await db[METRICS_COLL].count_documents({"meta.device_id": device_id})
-            
-            if device_metrics_count <= MIN_RECORDS_PER_DEVICE:
-                continue
-            
-            # Keep only the most recent records
-            metrics_to_keep = max(MIN_RECORDS_PER_DEVICE, device_metrics_count - 
-                await db[METRICS_COLL].count_documents({
-                    "meta.device_id": device_id,
-                    "ts": {"$lt": cutoff_time}
-                })
-            )
-            
-            if metrics_to_keep < device_metrics_count:
-                # Get the timestamp of the Nth most recent record
-                keep_threshold = await db[METRICS_COLL].find(
-                    {"meta.device_id": device_id}
-                ).sort("ts", -1).skip(metrics_to_keep - 1).limit(1).to_list(1)
-                
-                if keep_threshold:
-                    threshold_time = keep_threshold[0]["ts"]
-                    result = await db[METRICS_COLL].delete_many({
-                        "meta.device_id": device_id,
-                        "ts": {"$lt": threshold_time}
-                    })
-                    total_metrics_deleted += result.deleted_count
-        
-        # Cleanup events
-        events_result = await db[EVENTS_COLL].delete_many({
-            "detected_at": {"$lt": cutoff_time}
-        })
-        events_deleted = events_result.deleted_count
+        result = await enforce_retention(KEEP_DAYS, MIN_RECORDS_PER_DEVICE)
         
         # Get final stats
-        final_metrics_count = await db[METRICS_COLL].count_documents({})
-        final_events_count = await db[EVENTS_COLL].count_documents({})
+        final_metrics_count = await estimated_count(METRICS_COLL)
+        final_events_count = await estimated_count(EVENTS_COLL)
         
-        print(f"✅ Cleanup completed: deleted {total_metrics_deleted} metrics, {events_deleted} events")
+        print(f"✅ Cleanup completed: deleted {result['deleted']['metrics']} metrics, {result['deleted']['events']} events")
         print(f"📊 After cleanup: {final_metrics_count} metrics, {final_events_count} events")
         
     except Exception as e:
@@ -94,6 +317,591 @@ async def cleanup_scheduler():
         except Exception as e:
             print(f"❌ Error in cleanup scheduler: {e}")
 
+# ---------- Rollups ----------
+def rollup_coll(resolution: str) -> str:
+    return f"{METRICS_COLL}_{resolution}"
+
+async def ensure_rollup_collections():
+    for resolution, _, keep_days in ROLLUP_RESOLUTIONS:
+        coll = db[rollup_coll(resolution)]
+        try:
+            await coll.create_index([("device_id", 1), ("metric", 1), ("bucket", 1)], unique=True)
+            await coll.create_index([("bucket", 1)], name="bucket_ttl", expireAfterSeconds=keep_days * 86400)
+        except Exception as e:
+            print(f"Rollup index warning ({resolution}):", e)
+
+def _rollup_update(device_id: str, metric: str, bucket: datetime.datetime, agg: dict) -> UpdateOne:
+    """Upsert that merges a partial aggregate into the stored bucket"""
+    return UpdateOne(
+        {"device_id": device_id, "metric": metric, "bucket": bucket},
+        [{"$set": {
+            "min": {"$min": ["$min", agg["min"]]},
+            "max": {"$max": ["$max", agg["max"]]},
+            "sum": {"$add": [{"$ifNull": ["$sum", 0]}, agg["sum"]]},
+            "count": {"$add": [{"$ifNull": ["$count", 0]}, agg["count"]]},
+            "last": {"$cond": [{"$gte": [agg["last_ts"], {"$ifNull": ["$last_ts", agg["last_ts"]]}]},
+                               agg["last"], "$last"]},
+            "last_ts": {"$max": ["$last_ts", agg["last_ts"]]}
+        }}],
+        upsert=True
+    )
+
+async def update_rollups(docs: List[dict]):
+    """Fold a batch of numeric metric documents into every rollup resolution"""
+    for resolution, seconds, _ in ROLLUP_RESOLUTIONS:
+        buckets: Dict[tuple, dict] = {}
+        for d in docs:
+            value = d.get("value")
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            device_id = (d.get("meta") or {}).get("device_id")
+            epoch = d["ts"].timestamp()
+            key = (device_id, d.get("metric"), int(epoch // seconds * seconds))
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = {"min": value, "max": value, "sum": value, "count": 1, "last": value, "last_ts": epoch}
+            else:
+                agg["min"] = min(agg["min"], value)
+                agg["max"] = max(agg["max"], value)
+                agg["sum"] += value
+                agg["count"] += 1
+                if epoch >= agg["last_ts"]:
+                    agg["last"], agg["last_ts"] = value, epoch
+        if buckets:
+            ops = [
+                _rollup_update(device_id, metric, datetime.datetime.fromtimestamp(bucket), agg)
+                for (device_id, metric, bucket), agg in buckets.items()
+            ]
+            with INSTRUMENTS.mongo_op("bulk_write", rollup_coll(resolution)):
+                await db[rollup_coll(resolution)].bulk_write(ops, ordered=False)
+
+def pick_resolution(start_ts: int, end_ts: int, max_points: int) -> str:
+    """Finest resolution whose expected point count fits max_points and whose data is still retained"""
+    span = max(0, end_ts - start_ts)
+    age = time.time() - start_ts
+    # Raw points older than KEEP_DAYS are thinned to MIN_RECORDS_PER_DEVICE by enforce_retention
+    candidates = [("raw", RAW_INTERVAL_SECONDS, KEEP_DAYS)]
+    if ROLLUPS_ENABLED:
+        candidates += ROLLUP_RESOLUTIONS
+    for name, seconds, keep_days in candidates:
+        if age <= keep_days * 86400 and span / max(seconds, 1) <= max_points:
+            return name
+    return candidates[-1][0]
+
+# ---------- Downsampling ----------
+def bucket_average(points: List[tuple], max_points: int) -> List[tuple]:
+    """Average consecutive (ts, value) points into at most max_points buckets"""
+    if len(points) <= max_points:
+        return points
+    size = len(points) / max_points
+    out = []
+    for i in range(max_points):
+        chunk = points[int(i * size):int((i + 1) * size)]
+        if chunk:
+            out.append((chunk[0][0], sum(p[1] for p in chunk) / len(chunk)))
+    return out
+
+def lttb(points: List[tuple], max_points: int) -> List[tuple]:
+    """Largest-Triangle-Three-Buckets: keeps first/last and the most shape-defining point per bucket"""
+    n = len(points)
+    if n <= max_points:
+        return points
+    if max_points < 3:
+        return [points[0], points[-1]]
+    out = [points[0]]
+    size = (n - 2) / (max_points - 2)
+    a = 0
+    for i in range(max_points - 2):
+        start = int(i * size) + 1
+        end = int((i + 1) * size) + 1
+        next_end = min(int((i + 2) * size) + 1, n)
+        # average of the next bucket (or the last point for the final bucket)
+        nxt = points[end:next_end] or points[-1:]
+        avg_t = sum(p[0] for p in nxt) / len(nxt)
+        avg_v = sum(p[1] for p in nxt) / len(nxt)
+        at, av = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            t, v = points[j]
+            area = abs((at - avg_t) * (v - av) - (at - t) * (avg_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(points[best])
+        a = best
+    out.append(points[-1])
+    return out
+
+async def downsample_raw(device_id: str, metric: str, start: datetime.datetime, end: datetime.datetime,
+                         max_points: int, mode: str) -> List[dict]:
+    """Downsample raw metrics for one series, returning at most max_points {ts, value} rows"""
+    match = {
+        "meta.device_id": device_id,
+        "metric": metric,
+        "ts": {"$gte": start, "$lte": end},
+        "value": {"$type": "number"}
+    }
+    if mode == "avg":
+        # Buckets start at `start` and span_ms < width_ms * max_points, so even a point at
+        # `end` falls in one of max_points buckets
+        span_ms = max(0, int((end - start).total_seconds() * 1000))
+        width_ms = span_ms // max_points + 1
+        offset_ms = {"$subtract": ["$ts", start]}
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                # Keep the bucket a date so it converts to epoch like every other path
+                "_id": {"$add": [start, {"$subtract": [offset_ms, {"$mod": [offset_ms, width_ms]}]}]},
+                "value": {"$avg": "$value"}
+            }},
+            {"$sort": {"_id": 1}},
+            {"$limit": max_points}
+        ]
+        with INSTRUMENTS.mongo_op("aggregate", METRICS_COLL):
+            return [{"ts": int(d["_id"].timestamp()), "value": d["value"]}
+                    async for d in db[METRICS_COLL].aggregate(pipeline, allowDiskUse=True)]
+    cursor = db[METRICS_COLL].find(match, {"_id": 0, "ts": 1, "value": 1}).sort("ts", 1).limit(LTTB_MAX_SCAN)
+    with INSTRUMENTS.mongo_op("find", METRICS_COLL):
+        points = [(d["ts"].timestamp(), d["value"]) async for d in cursor]
+    return [{"ts": int(t), "value": v} for t, v in lttb(points, max_points)]
+
+# ---------- Device inventory ----------
+INVENTORY_FIELDS = ("hostid", "ifdescr", "location", "city", "country", "connected_to", "connected_interface")
+
+# (device_id, ifindex) -> (last written inventory fields, time written), so unchanged
+# interfaces cost no writes until their updated_at needs refreshing
+inventory_seen: Dict[tuple, tuple] = {}
+
+async def ensure_inventory():
+    coll = db[DEVICES_COLL]
+    try:
+        await coll.create_index([("device_id", 1), ("ifindex", 1)], unique=True)
+        for field in ("location", "city", "country"):
+            await coll.create_index([(field, 1), ("device_id", 1)])
+    except Exception as e:
+        print("Inventory index warning:", e)
+    # Decommissioned devices and interfaces leave the inventory with their data
+    try:
+        await coll.create_index([("updated_at", 1)], name="updated_at_ttl",
+                                expireAfterSeconds=METRICS_EXPIRE_DAYS * 86400)
+    except Exception:
+        try:
+            await db.command({"collMod": DEVICES_COLL,
+                              "index": {"name": "updated_at_ttl", "expireAfterSeconds": METRICS_EXPIRE_DAYS * 86400}})
+        except Exception as e:
+            print("Warning: could not set inventory TTL index:", e)
+    if await coll.estimated_document_count() == 0 and await estimated_count(METRICS_COLL):
+        # Full scan of the metrics collection: run it off the startup path
+        asyncio.create_task(backfill_inventory())
+
+async def backfill_inventory():
+    """One-time fill of an empty inventory from the newest metadata of each interface"""
+    try:
+        print("📇 Backfilling device inventory from metrics (one-time)")
+        group = {"_id": {"device_id": "$meta.device_id", "ifindex": "$meta.ifindex"}}
+        group.update({field: {"$last": f"$meta.{field}"} for field in INVENTORY_FIELDS})
+        cursor = db[METRICS_COLL].aggregate([
+            {"$sort": {"ts": 1}},
+            {"$group": group}
+        ], allowDiskUse=True)
+        docs = []
+        async for d in cursor:
+            d.update(d.pop("_id"))
+            docs.append({"meta": d})
+        upserted = await update_inventory(docs)
+        print(f"📇 Inventory backfilled with {upserted} interfaces")
+    except Exception as e:
+        print("Inventory backfill warning:", e)
+
+async def update_inventory(docs: List[dict]) -> int:
+    """Upsert (device_id, ifindex) inventory rows that are new, changed or due for a new updated_at"""
+    now = time.monotonic()
+    changed: Dict[tuple, tuple] = {}
+    for d in docs:
+        meta = d.get("meta") or {}
+        device_id = meta.get("device_id")
+        if device_id is None:
+            continue
+        key = (device_id, meta.get("ifindex"))
+        fields = tuple(meta.get(field) for field in INVENTORY_FIELDS)
+        if key[1] is None:
+            # Device-level row: "System" and "Other" docs share it, so ifdescr is not tracked
+            fields = tuple(None if field == "ifdescr" else value for field, value in zip(INVENTORY_FIELDS, fields))
+        seen = inventory_seen.get(key)
+        if seen is None or seen[0] != fields or now - seen[1] >= INVENTORY_TOUCH_SECONDS:
+            changed[key] = fields
+    if not changed:
+        return 0
+    ops = [
+        UpdateOne(
+            {"device_id": device_id, "ifindex": ifindex},
+            {"$set": dict(zip(INVENTORY_FIELDS, fields), updated_at=datetime.datetime.utcnow())},
+            upsert=True
+        )
+        for (device_id, ifindex), fields in changed.items()
+    ]
+    with INSTRUMENTS.mongo_op("bulk_write", DEVICES_COLL):
+        await db[DEVICES_COLL].bulk_write(ops, ordered=False)
+    inventory_seen.update((key, (fields, now)) for key, fields in changed.items())
+    return len(ops)
+
+IFINDEX_KEY_REGEX = re.compile(r"if_(\d+)")
+
+def _ifindex_int(ifindex: Any) -> Optional[int]:
+    """Agent ifindex keys look like 'if_12'; the API exposes the numeric part"""
+    if isinstance(ifindex, int):
+        return ifindex
+    match = IFINDEX_KEY_REGEX.fullmatch(str(ifindex or ""))
+    return int(match.group(1)) if match else None
+
+# ---------- Stats ----------
+stats_cache: Dict[str, Any] = {"at": 0.0, "value": None}
+stats_lock = asyncio.Lock()
+
+async def storage_stats(coll_name: str) -> Optional[dict]:
+    """Storage and index sizes (bytes) from $collStats"""
+    try:
+        async for st in db[coll_name].aggregate([{"$collStats": {"storageStats": {}}}]):
+            storage = st.get("storageStats", {})
+            return {
+                "size": storage.get("size"),
+                "storage_size": storage.get("storageSize"),
+                "total_index_size": storage.get("totalIndexSize"),
+                "index_sizes": storage.get("indexSizes", {})
+            }
+    except Exception:
+        pass
+    return None
+
+async def ts_bound(direction: int) -> Optional[datetime.datetime]:
+    """Oldest/newest metric timestamp, read from the end of the ts index"""
+    try:
+        doc = await db[METRICS_COLL].find_one({}, {"ts": 1, "_id": 0}, sort=[("ts", direction)], hint=[("ts", 1)])
+    except Exception:
+        doc = await db[METRICS_COLL].find_one({}, {"ts": 1, "_id": 0}, sort=[("ts", direction)])
+    return doc["ts"] if doc else None
+
+async def collect_stats() -> dict:
+    oldest = await ts_bound(1)
+    newest = await ts_bound(-1)
+    colls = [METRICS_COLL, EVENTS_COLL, DEVICES_COLL]
+    if ROLLUPS_ENABLED:
+        colls += [rollup_coll(resolution) for resolution, _, _ in ROLLUP_RESOLUTIONS]
+    return {
+        "metrics": await estimated_count(METRICS_COLL),
+        "events": await estimated_count(EVENTS_COLL),
+        "devices": len(await db[DEVICES_COLL].distinct("device_id")),
+        "date_range": {
+            "oldest": oldest.isoformat() if oldest else None,
+            "newest": newest.isoformat() if newest else None
+        },
+        "storage": {name: await storage_stats(name) for name in colls}
+    }
+
+async def cached_stats(refresh: bool = False) -> dict:
+    """collect_stats() at most once per STATS_CACHE_SECONDS; concurrent callers share one refresh"""
+    async with stats_lock:
+        age = time.time() - stats_cache["at"]
+        if refresh or stats_cache["value"] is None or age >= STATS_CACHE_SECONDS:
+            stats_cache["value"] = await collect_stats()
+            stats_cache["at"] = time.time()
+        return stats_cache["value"]
+
+# ---------- Latest values ----------
+class LatestStore:
+    """Newest value per (device_id, metric), kept in process and updated on every ingest"""
+
+    def __init__(self):
+        self.by_device: Dict[str, Dict[str, dict]] = {}
+        self.location: Dict[str, Optional[str]] = {}
+
+    def update(self, docs: List[dict]):
+        for d in docs:
+            meta = d.get("meta") or {}
+            device_id = meta.get("device_id")
+            if device_id is None:
+                continue
+            ts = int(d["ts"].timestamp()) if isinstance(d.get("ts"), datetime.datetime) else d.get("ts")
+            metrics = self.by_device.setdefault(device_id, {})
+            current = metrics.get(d.get("metric"))
+            if current is not None and (ts or 0) < (current["ts"] or 0):
+                continue
+            metrics[d.get("metric")] = {
+                "device_id": device_id,
+                "hostid": meta.get("hostid"),
+                "ifindex": meta.get("ifindex"),
+                "ifdescr": meta.get("ifdescr"),
+                "metric": d.get("metric"),
+                "value": d.get("value"),
+                "value_type": d.get("value_type"),
+                "ts": ts
+            }
+            if meta.get("location") is not None:
+                self.location[device_id] = meta.get("location")
+
+    def query(self, device_id: Optional[str] = None, location: Optional[str] = None,
+              metric_prefix: Optional[str] = None) -> List[dict]:
+        if device_id is not None:
+            devices = [device_id] if device_id in self.by_device else []
+        else:
+            devices = list(self.by_device)
+        if location is not None:
+            devices = [dev for dev in devices if self.location.get(dev) == location]
+        out = []
+        for dev in devices:
+            for metric, entry in self.by_device[dev].items():
+                if metric_prefix is None or (metric or "").startswith(metric_prefix):
+                    out.append(dict(entry, location=self.location.get(dev)))
+        return out
+
+    def size(self) -> int:
+        return sum(len(m) for m in self.by_device.values())
+
+latest_values = LatestStore()
+
+async def warm_latest_values():
+    """Seed the latest-value table from the last LATEST_WARM_SECONDS of metrics"""
+    since = datetime.datetime.fromtimestamp(time.time() - LATEST_WARM_SECONDS)
+    cursor = db[METRICS_COLL].aggregate([
+        {"$match": {"ts": {"$gte": since}}},
+        {"$sort": {"ts": 1}},
+        {"$group": {
+            "_id": {"device_id": "$meta.device_id", "metric": "$metric"},
+            "ts": {"$last": "$ts"},
+            "meta": {"$last": "$meta"},
+            "value": {"$last": "$value"},
+            "value_type": {"$last": "$value_type"}
+        }}
+    ], allowDiskUse=True)
+    docs = []
+    async for d in cursor:
+        d["metric"] = d.pop("_id")["metric"]
+        docs.append(d)
+    latest_values.update(docs)
+    print(f"⚡ Latest-value table warmed with {latest_values.size()} series")
+
+# ---------- Live stream ----------
+def _stream_doc(doc: dict) -> dict:
+    """JSON-safe copy of an ingested document (datetimes as epoch seconds)"""
+    out = {}
+    for k, v in doc.items():
+        if k == "_id":
+            continue
+        out[k] = int(v.timestamp()) if isinstance(v, datetime.datetime) else v
+    return out
+
+class Subscriber:
+    def __init__(self, kinds: set, device_id: Optional[str], metric_prefix: Optional[str], severity: Optional[str]):
+        self.kinds = kinds
+        self.device_id = device_id
+        self.metric_prefix = metric_prefix
+        self.severity = severity
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_MAX)
+        self.dropped = 0
+
+    def wants(self, kind: str, doc: dict) -> bool:
+        if self.device_id is not None:
+            device_id = (doc.get("meta") or {}).get("device_id") if kind == "metrics" else doc.get("device_id")
+            if device_id != self.device_id:
+                return False
+        if self.metric_prefix is not None and not (doc.get("metric") or "").startswith(self.metric_prefix):
+            return False
+        # metrics carry no severity, so a severity filter selects events only
+        if self.severity is not None and doc.get("severity") != self.severity:
+            return False
+        return True
+
+class StreamHub:
+    """Fans ingested batches out to SSE subscribers without ever blocking ingest"""
+
+    def __init__(self):
+        self.subscribers: set = set()
+
+    def subscribe(self, sub: Subscriber):
+        self.subscribers.add(sub)
+
+    def unsubscribe(self, sub: Subscriber):
+        self.subscribers.discard(sub)
+
+    def publish(self, kind: str, docs: List[dict]):
+        if not self.subscribers:
+            return
+        converted: Dict[int, dict] = {}
+        for sub in list(self.subscribers):
+            if kind not in sub.kinds:
+                continue
+            batch = []
+            for i, d in enumerate(docs):
+                if sub.wants(kind, d):
+                    if i not in converted:
+                        converted[i] = _stream_doc(d)
+                    batch.append(converted[i])
+            if not batch:
+                continue
+            try:
+                sub.queue.put_nowait((kind, batch))
+            except asyncio.QueueFull:
+                sub.dropped += len(batch)
+
+stream_hub = StreamHub()
+
+# ---------- write coalescing buffer ----------
+class WriteBuffer:
+    """Bounded in-process buffer that coalesces inserts into one collection.
+
+    put() waits up to WRITE_BUFFER_WAIT_SECONDS for room and reports False
+    when the buffer stays full, so callers can push back on clients. The
+    flusher writes when WRITE_BUFFER_FLUSH_DOCS documents are pending or the
+    oldest one has waited WRITE_BUFFER_FLUSH_MS.
+    """
+
+    def __init__(self, name: str, writer: Callable, max_docs: int = WRITE_BUFFER_MAX_DOCS,
+                 flush_docs: int = WRITE_BUFFER_FLUSH_DOCS, flush_ms: int = WRITE_BUFFER_FLUSH_MS):
+        self.name = name
+        self.writer = writer
+        self.max_docs = max_docs
+        self.flush_docs = flush_docs
+        self.flush_interval = flush_ms / 1000.0
+        self.docs: List[dict] = []
+        self.oldest: Optional[float] = None
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+        self.stats = {
+            "accepted": 0, "rejected": 0, "flushed": 0, "failed": 0, "flushes": 0,
+            "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0
+        }
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def put(self, docs: List[dict], timeout: float = WRITE_BUFFER_WAIT_SECONDS) -> bool:
+        def has_room():
+            return not self.docs or len(self.docs) + len(docs) <= self.max_docs
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(has_room), timeout)
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += len(docs)
+                return False
+            if not self.docs:
+                self.oldest = time.monotonic()
+            self.docs.extend(docs)
+            self.stats["accepted"] += len(docs)
+            self.changed.notify_all()
+        return True
+
+    async def _run(self):
+        while not self.closing:
+            async with self.changed:
+                try:
+                    await asyncio.wait_for(
+                        self.changed.wait_for(lambda: len(self.docs) >= self.flush_docs or self.closing),
+                        self._time_to_deadline()
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    def _time_to_deadline(self) -> float:
+        if self.oldest is None:
+            return self.flush_interval
+        return max(0.0, self.oldest + self.flush_interval - time.monotonic())
+
+    async def flush(self):
+        """Write everything currently buffered, in batches of at most flush_docs"""
+        while self.docs:
+            async with self.changed:
+                batch = self.docs[:self.flush_docs]
+                del self.docs[:self.flush_docs]
+                self.oldest = time.monotonic() if self.docs else None
+                self.changed.notify_all()
+            start = time.perf_counter()
+            for attempt in range(3):
+                try:
+                    await self.writer(batch)
+                    self.stats["flushed"] += len(batch)
+                    break
+                except ServerSelectionTimeoutError as e:
+                    # No server was reached, so nothing was written: safe to try again
+                    print(f"⚠️ {self.name} buffer flush failed (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(0.5 * (attempt + 1))
+                except ConnectionFailure as e:
+                    # The connection dropped mid-insert: part of the batch may be stored, and the
+                    # time-series collection does not dedupe _id, so a retry could duplicate points
+                    print(f"❌ {self.name} buffer flush interrupted, not retrying {len(batch)} documents: {e}")
+                    self.stats["failed"] += len(batch)
+                    break
+                except Exception as e:
+                    print(f"❌ {self.name} buffer flush failed, dropping {len(batch)} documents: {e}")
+                    self.stats["failed"] += len(batch)
+                    break
+            else:
+                self.stats["failed"] += len(batch)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats["flushes"] += 1
+            self.stats["last_flush_ms"] = round(elapsed_ms, 2)
+            self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed_ms), 2)
+            self.stats["total_flush_ms"] += elapsed_ms
+
+    async def close(self):
+        """Stop the flusher and write out whatever is still buffered"""
+        self.closing = True
+        async with self.changed:
+            self.changed.notify_all()
+        if self.task is not None:
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def snapshot(self) -> dict:
+        flushes = self.stats["flushes"]
+        return {
+            "queue_depth": len(self.docs),
+            "max_docs": self.max_docs,
+            "accepted": self.stats["accepted"],
+            "rejected": self.stats["rejected"],
+            "flushed": self.stats["flushed"],
+            "failed": self.stats["failed"],
+            "flushes": flushes,
+            "last_flush_ms": self.stats["last_flush_ms"],
+            "max_flush_ms": self.stats["max_flush_ms"],
+            "avg_flush_ms": round(self.stats["total_flush_ms"] / flushes, 2) if flushes else 0.0
+        }
+
+async def write_metric_docs(docs: List[dict], ordered: bool = False) -> int:
+    with INSTRUMENTS.mongo_op("insert_many", METRICS_COLL):
+        res = await db[METRICS_COLL].insert_many(docs, ordered=ordered)
+    if ROLLUPS_ENABLED:
+        try:
+            await update_rollups(docs)
+        except Exception as e:
+            print(f"⚠️ Rollup update failed: {e}")
+    try:
+        await update_inventory(docs)
+    except Exception as e:
+        print(f"⚠️ Inventory update failed: {e}")
+    return len(res.inserted_ids)
+
+async def write_event_docs(docs: List[dict], ordered: bool = False) -> int:
+    with INSTRUMENTS.mongo_op("insert_many", EVENTS_COLL):
+        res = await db[EVENTS_COLL].insert_many(docs, ordered=ordered)
+    return len(res.inserted_ids)
+
+write_buffers: Dict[str, WriteBuffer] = {}
+
+async def buffer_or_write(kind: str, docs: List[dict], writer: Callable):
+    """Hand documents to the write buffer (202) or insert them right away (201)"""
+    buffer = write_buffers.get(kind)
+    if buffer is not None:
+        if not await buffer.put(docs):
+            raise HTTPException(503, f"{kind} write buffer is full, retry later", headers={"Retry-After": "1"})
+        return JSONResponse(status_code=202, content={"accepted": len(docs)})
+    try:
+        return {"inserted": await writer(docs, ordered=not INGEST_FAST_PATH)}
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
 # ---------- Pydantic models ----------
 class MetricIn(BaseModel):
     ts: Optional[int] = Field(default_factory=lambda: int(time.time()))
@@ -128,6 +936,191 @@ class DeviceOut(BaseModel):
     interfaces: List[InterfaceOut] = []
     connections: List[Dict[str, Any]] = []
 
+# ---------- compact metrics wire format ----------
+COMPACT_FORMAT = "compact-v1"
+COMPACT_CONTENT_TYPE_MSGPACK = "application/x-msgpack"
+COMPACT_CONTENT_TYPE_JSON = "application/vnd.netmon.compact+json"
+
+def decode_column(column: Any, count: int) -> List[Any]:
+    if isinstance(column, dict):
+        if "const" in column:
+            return [column["const"]] * count
+        if "dict" in column:
+            values = column["dict"]
+            return [values[c] for c in column["codes"]]
+    if not isinstance(column, list) or len(column) != count:
+        raise ValueError("column length does not match host count")
+    return column
+
+def expand_compact_metrics(batch: dict) -> List[dict]:
+    """Turn a compact-v1 batch back into plain metric documents"""
+    if batch.get("format") != COMPACT_FORMAT:
+        raise ValueError(f"unsupported compact format: {batch.get('format')}")
+    docs = []
+    for host in batch.get("hosts", []):
+        count = int(host["count"])
+        shared = host.get("meta") or {}
+        columns = {name: decode_column(col, count) for name, col in (host.get("columns") or {}).items()}
+        meta_columns = [(name[5:], values) for name, values in columns.items() if name.startswith("meta.")]
+        field_columns = [(name, values) for name, values in columns.items() if not name.startswith("meta.")]
+        for i in range(count):
+            meta = dict(shared)
+            for name, values in meta_columns:
+                meta[name] = values[i]
+            doc = {name: values[i] for name, values in field_columns}
+            doc["meta"] = meta
+            docs.append(doc)
+    return docs
+
+async def read_metrics_payload(request: Request) -> List[Any]:
+    """Metric documents from a plain JSON list or a compact batch (JSON or msgpack)"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        if content_type == COMPACT_CONTENT_TYPE_MSGPACK:
+            if msgpack is None:
+                raise HTTPException(415, "msgpack is not installed on this server")
+            return expand_compact_metrics(msgpack.unpackb(body, raw=False))
+        data = json_loads(body)
+        if isinstance(data, dict) and data.get("format") == COMPACT_FORMAT:
+            return expand_compact_metrics(data)
+    except HTTPException:
+        raise
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        raise HTTPException(400, f"Invalid metrics payload: {e}")
+    if not isinstance(data, list):
+        raise HTTPException(422, "Expected a list of metrics or a compact batch")
+    return data
+
+async def read_json_list(request: Request) -> List[Any]:
+    try:
+        data = json_loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid JSON body: {e}")
+    if not isinstance(data, list):
+        raise HTTPException(422, "Expected a list")
+    return data
+
+# ---------- fast ingest path ----------
+# Epoch seconds accepted as-is; anything outside falls back to "now" like an unparsable value
+MIN_EPOCH = 0
+MAX_EPOCH = 32503680000  # year 3000
+
+# Integer strings as MetricIn/EventIn accept them: sign, digit groups, optional ".0"
+INT_STRING_REGEX = re.compile(r"[+-]?\d+(?:_\d+)*(?:\.0+)?")
+
+def _epoch_or_none(value: Any) -> Optional[int]:
+    """Integer epoch under the models' int rules, None when missing or out of range.
+
+    Like the Optional[int] ts/detected_at fields this accepts ints, integral
+    floats and integer strings and rejects fractions. Unlike the model path,
+    epochs outside MIN_EPOCH..MAX_EPOCH (including ints too large for the
+    model) are stored as "now" instead of being kept or rejected.
+    """
+    if value is None:
+        return None
+    if isinstance(value, int):  # bool included, as pydantic coerces it too
+        ts = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        ts = int(value)
+    elif isinstance(value, str) and INT_STRING_REGEX.fullmatch(value.strip()):
+        ts = int(value.strip().split(".")[0])
+    else:
+        raise ValueError("not an integer")
+    return ts if MIN_EPOCH <= ts <= MAX_EPOCH else None
+
+def _to_datetimes(epochs: List[Optional[int]]) -> List[datetime.datetime]:
+    """Convert epochs in bulk; agents send the same ts for a whole host, so conversions are shared"""
+    now = datetime.datetime.utcnow()
+    converted: Dict[int, datetime.datetime] = {}
+    out = []
+    for ts in epochs:
+        if ts is None:
+            out.append(now)
+            continue
+        dt = converted.get(ts)
+        if dt is None:
+            dt = converted[ts] = datetime.datetime.fromtimestamp(ts)
+        out.append(dt)
+    return out
+
+def validate_metrics_fast(items: List[Any]) -> List[dict]:
+    """Validate and normalize a whole metrics batch in one pass (same shape as MetricIn.dict())"""
+    errors = []
+    docs = []
+    epochs = []
+    now = int(time.time())
+    for i, m in enumerate(items):
+        if not isinstance(m, dict):
+            errors.append({"loc": [i], "msg": "must be an object"})
+            continue
+        meta = m.get("meta")
+        metric = m.get("metric")
+        value_type = m.get("value_type", "gauge")
+        if not isinstance(meta, dict):
+            errors.append({"loc": [i, "meta"], "msg": "field required (object)"})
+        if not isinstance(metric, str):
+            errors.append({"loc": [i, "metric"], "msg": "field required (string)"})
+        if value_type is not None and not isinstance(value_type, str):
+            errors.append({"loc": [i, "value_type"], "msg": "must be a string"})
+        if "value" not in m:
+            errors.append({"loc": [i, "value"], "msg": "field required"})
+        try:
+            epochs.append(_epoch_or_none(m.get("ts", now)))
+        except ValueError:
+            errors.append({"loc": [i, "ts"], "msg": "must be an integer timestamp"})
+        docs.append({"ts": None, "meta": meta, "metric": metric, "value": m.get("value"), "value_type": value_type})
+    if errors:
+        raise HTTPException(422, errors[:100])
+    for doc, dt in zip(docs, _to_datetimes(epochs)):
+        doc["ts"] = dt
+    return docs
+
+def validate_events_fast(items: List[Any]) -> List[dict]:
+    """Validate and normalize a whole events batch in one pass (same shape as EventIn.dict())"""
+    errors = []
+    docs = []
+    epochs = []
+    now = int(time.time())
+    optional_str = ("hostid", "iface", "severity")
+    for i, e in enumerate(items):
+        if not isinstance(e, dict):
+            errors.append({"loc": [i], "msg": "must be an object"})
+            continue
+        for field in ("device_id", "metric", "status"):
+            if not isinstance(e.get(field), str):
+                errors.append({"loc": [i, field], "msg": "field required (string)"})
+        for field in optional_str:
+            if e.get(field) is not None and not isinstance(e.get(field), str):
+                errors.append({"loc": [i, field], "msg": "must be a string"})
+        evidence = e.get("evidence")
+        if evidence is not None and not isinstance(evidence, dict):
+            errors.append({"loc": [i, "evidence"], "msg": "must be an object"})
+        labels = e.get("labels", [])
+        if labels is not None and not (isinstance(labels, list) and all(isinstance(l, str) for l in labels)):
+            errors.append({"loc": [i, "labels"], "msg": "must be a list of strings"})
+        try:
+            epochs.append(_epoch_or_none(e.get("detected_at", now)))
+        except ValueError:
+            errors.append({"loc": [i, "detected_at"], "msg": "must be an integer timestamp"})
+        docs.append({
+            "device_id": e.get("device_id"),
+            "hostid": e.get("hostid"),
+            "iface": e.get("iface"),
+            "metric": e.get("metric"),
+            "value": e.get("value"),
+            "status": e.get("status"),
+            "severity": e.get("severity", "info"),
+            "detected_at": None,
+            "evidence": evidence,
+            "labels": labels
+        })
+    if errors:
+        raise HTTPException(422, errors[:100])
+    for doc, dt in zip(docs, _to_datetimes(epochs)):
+        doc["detected_at"] = dt
+    return docs
+
 # ---------- endpoints ----------
 @app.on_event("startup")
 async def ensure_collections():
@@ -141,7 +1134,8 @@ async def ensure_collections():
                     "timeField": "ts",
                     "metaField": "meta",
                     "granularity": "seconds"
-                }
+                },
+                expireAfterSeconds=METRICS_EXPIRE_DAYS * 86400
             )
         except Exception as e:
             # some servers may not allow create_collection via Motor the same; fail fast
@@ -149,10 +1143,27 @@ async def ensure_collections():
     # create indexes
     try:
         await db[METRICS_COLL].create_index([("meta.device_id", 1), ("metric", 1)])
+        await db[METRICS_COLL].create_index([("meta.device_id", 1), ("ts", -1)])
+        await db[METRICS_COLL].create_index([("ts", 1)])
         await db[EVENTS_COLL].create_index([("device_id", 1), ("detected_at", -1)])
     except Exception as e:
         print("Index creation warning:", e)
+    await ensure_retention()
+    await ensure_inventory()
+    try:
+        await warm_latest_values()
+    except Exception as e:
+        print("Latest-value warm-up warning:", e)
+    if ROLLUPS_ENABLED:
+        await ensure_rollup_collections()
     
+    if WRITE_BUFFER_ENABLED:
+        print(f"📥 Write buffer enabled (flush every {WRITE_BUFFER_FLUSH_DOCS} docs / {WRITE_BUFFER_FLUSH_MS} ms)")
+        write_buffers["metrics"] = WriteBuffer("metrics", write_metric_docs)
+        write_buffers["events"] = WriteBuffer("events", write_event_docs)
+        for buffer in write_buffers.values():
+            buffer.start()
+
     # Start cleanup scheduler if enabled
     if CLEANUP_ENABLED:
         print(f"🧹 Starting cleanup scheduler (every {CLEANUP_INTERVAL_HOURS} hours)")
@@ -160,8 +1171,19 @@ async def ensure_collections():
     else:
         print("🧹 Cleanup scheduler disabled")
 
-@app.post("/ingest/metrics", status_code=201)
-async def ingest_metrics(payload: List[MetricIn]):
+@app.on_event("shutdown")
+async def flush_write_buffers():
+    for kind, buffer in list(write_buffers.items()):
+        await buffer.close()
+        print(f"📥 Flushed {kind} write buffer on shutdown")
+    write_buffers.clear()
+
+def prepare_metric_docs(items: List[Any]) -> List[dict]:
+    """Validate metrics with MetricIn and convert ts to datetime (model path)"""
+    try:
+        payload = [MetricIn(**m) for m in items]
+    except (ValidationError, TypeError) as e:
+        raise HTTPException(422, e.errors() if isinstance(e, ValidationError) else str(e))
     docs = []
     for m in payload:
         doc = m.dict()
@@ -171,43 +1193,158 @@ async def ingest_metrics(payload: List[MetricIn]):
         except Exception:
             doc["ts"] = datetime.datetime.utcnow()
         docs.append(doc)
-    try:
-        res = await db[METRICS_COLL].insert_many(docs)
-        return {"inserted": len(res.inserted_ids)}
-    except Exception as e:
-        raise HTTPException(500, str(e))
+    return docs
 
-@app.post("/ingest/events", status_code=201)
-
-async def ingest_events(payload: List[EventIn]):
-    docs = [e.dict() for e in payload]
+def prepare_event_docs(items: List[Any]) -> List[dict]:
+    """Validate events with EventIn and convert detected_at to datetime (model path)"""
+    try:
+        docs = [EventIn(**e).dict() for e in items]
+    except (ValidationError, TypeError) as e:
+        raise HTTPException(422, e.errors() if isinstance(e, ValidationError) else str(e))
     for d in docs:
         try:
             d["detected_at"] = datetime.datetime.fromtimestamp(int(d.get("detected_at", time.time())))
         except Exception:
             d["detected_at"] = datetime.datetime.utcnow()
-    try:
-        res = await db[EVENTS_COLL].insert_many(docs)
-        return {"inserted": len(res.inserted_ids)}
-    except Exception as e:
-        raise HTTPException(500, str(e))
+    return docs
+
+@app.post("/ingest/metrics", status_code=201)
+async def ingest_metrics(request: Request):
+    items = await read_metrics_payload(request)
+    docs = validate_metrics_fast(items) if INGEST_FAST_PATH else prepare_metric_docs(items)
+    INSTRUMENTS.observe("backend_ingest_batch_size", {"kind": "metrics"}, len(docs), SIZE_BUCKETS)
+    if not docs:
+        return {"inserted": 0}
+    response = await buffer_or_write("metrics", docs, write_metric_docs)
+    # Only documents that were stored (or accepted by the write buffer) reach /latest and /stream;
+    # rejected batches are retried by the agent and would otherwise show up twice
+    latest_values.update(docs)
+    stream_hub.publish("metrics", docs)
+    return response
+
+@app.post("/ingest/events", status_code=201)
+async def ingest_events(request: Request):
+    items = await read_json_list(request)
+    docs = validate_events_fast(items) if INGEST_FAST_PATH else prepare_event_docs(items)
+    INSTRUMENTS.observe("backend_ingest_batch_size", {"kind": "events"}, len(docs), SIZE_BUCKETS)
+    if not docs:
+        return {"inserted": 0}
+    response = await buffer_or_write("events", docs, write_event_docs)
+    stream_hub.publish("events", docs)
+    return response
 
 @app.get("/metrics")
-async def get_metrics(device_id: str, metric: str, start_ts: int, end_ts: int, limit: int = 1000):
+async def get_metrics(device_id: str, metric: str, start_ts: int, end_ts: int, limit: int = 1000,
+                      resolution: str = Query("auto", pattern="^(auto|raw|1m|5m|1h)$"),
+                      max_points: Optional[int] = Query(None, ge=2, le=100000),
+                      downsample: str = Query("avg", pattern="^(avg|lttb)$")):
     start = datetime.datetime.fromtimestamp(start_ts)
     end = datetime.datetime.fromtimestamp(end_ts)
+    if resolution == "auto":
+        resolution = pick_resolution(start_ts, end_ts, max_points or limit)
+        if resolution != "raw" and not await rollup_covers(device_id, metric, start, end, resolution):
+            resolution = "raw"
+    if max_points:
+        if resolution == "raw":
+            data = await downsample_raw(device_id, metric, start, end, max_points, downsample)
+        else:
+            # Fetch every bucket in range: pick_resolution sized the resolution against max_points, not limit
+            seconds = dict((name, secs) for name, secs, _ in ROLLUP_RESOLUTIONS)[resolution]
+            buckets = max(0, end_ts - start_ts) // seconds + 1
+            fetch = min(max(limit, max_points, buckets), LTTB_MAX_SCAN)
+            rows = await get_rollup_metrics(device_id, metric, start, end, fetch, resolution)
+            points = [(d["ts"], d["value"]) for d in rows["data"] if d["value"] is not None]
+            reduce = lttb if downsample == "lttb" else bucket_average
+            data = [{"ts": int(t), "value": v} for t, v in reduce(points, max_points)]
+        return {"count": len(data), "resolution": resolution, "downsample": downsample, "data": data}
+    if resolution != "raw":
+        return await get_rollup_metrics(device_id, metric, start, end, limit, resolution)
     cursor = db[METRICS_COLL].find({
         "meta.device_id": device_id,
         "metric": metric,
         "ts": {"$gte": start, "$lte": end}
     }).sort("ts", 1).limit(limit)
+    with INSTRUMENTS.mongo_op("find", METRICS_COLL):
+        rows = await cursor.to_list(None)
     docs = []
-    async for d in cursor:
+    for d in rows:
         d["_id"] = str(d["_id"])
         # convert ts back to epoch
         d["ts"] = int(d["ts"].timestamp())
         docs.append(d)
-    return {"count": len(docs), "data": docs}
+    return {"count": len(docs), "resolution": "raw", "data": docs}
+
+async def rollup_covers(device_id: str, metric: str, start: datetime.datetime, end: datetime.datetime,
+                        resolution: str) -> bool:
+    """False when raw points in range predate the rollup (e.g. data ingested before rollups existed)"""
+    seconds = dict((name, secs) for name, secs, _ in ROLLUP_RESOLUTIONS)[resolution]
+    first_raw = await db[METRICS_COLL].find_one(
+        {"meta.device_id": device_id, "metric": metric, "ts": {"$gte": start, "$lte": end}},
+        {"_id": 0, "ts": 1}, sort=[("ts", 1)])
+    if first_raw is None:
+        return True  # nothing raw to fall back to
+    first_bucket = await db[rollup_coll(resolution)].find_one(
+        {"device_id": device_id, "metric": metric, "bucket": {"$lte": end}},
+        {"_id": 0, "bucket": 1}, sort=[("bucket", 1)])
+    return first_bucket is not None and first_bucket["bucket"] <= first_raw["ts"]
+
+async def get_rollup_metrics(device_id: str, metric: str, start: datetime.datetime, end: datetime.datetime,
+                             limit: int, resolution: str) -> dict:
+    cursor = db[rollup_coll(resolution)].find({
+        "device_id": device_id,
+        "metric": metric,
+        "bucket": {"$gte": start, "$lte": end}
+    }, {"_id": 0, "bucket": 1, "min": 1, "max": 1, "sum": 1, "count": 1, "last": 1}).sort("bucket", 1).limit(limit)
+    with INSTRUMENTS.mongo_op("find", rollup_coll(resolution)):
+        rows = await cursor.to_list(None)
+    docs = []
+    for d in rows:
+        avg = d["sum"] / d["count"] if d.get("count") else None
+        docs.append({
+            "ts": int(d["bucket"].timestamp()),
+            "metric": metric,
+            "meta": {"device_id": device_id},
+            "value": avg,
+            "min": d.get("min"),
+            "max": d.get("max"),
+            "avg": avg,
+            "last": d.get("last"),
+            "count": d.get("count")
+        })
+    return {"count": len(docs), "resolution": resolution, "data": docs}
+
+@app.get("/latest")
+async def get_latest(device_id: Optional[str] = None, location: Optional[str] = None,
+                     metric_prefix: Optional[str] = None):
+    """Current value of each (device_id, metric), served from memory"""
+    data = latest_values.query(device_id, location, metric_prefix)
+    return {"count": len(data), "data": data}
+
+@app.get("/stream")
+async def stream(request: Request, device_id: Optional[str] = None, metric_prefix: Optional[str] = None,
+                 severity: Optional[str] = None,
+                 kinds: str = Query("metrics,events", pattern="^(metrics|events)(,(metrics|events))?$")):
+    """Server-Sent Events feed of newly ingested metrics/events"""
+    sub = Subscriber(set(kinds.split(",")), device_id, metric_prefix, severity)
+    stream_hub.subscribe(sub)
+
+    async def frames():
+        try:
+            while not await request.is_disconnected():
+                if sub.dropped:
+                    yield f"event: dropped\ndata: {json.dumps({'dropped': sub.dropped})}\n\n"
+                    sub.dropped = 0
+                try:
+                    kind, batch = await asyncio.wait_for(sub.queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {kind}\ndata: {json.dumps(batch, default=str)}\n\n"
+        finally:
+            stream_hub.unsubscribe(sub)
+
+    return StreamingResponse(frames(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/admin/cleanup")
 async def manual_cleanup(keep_days: int = KEEP_DAYS, min_records: int = MIN_RECORDS_PER_DEVICE):
@@ -215,54 +1352,18 @@ async def manual_cleanup(keep_days: int = KEEP_DAYS, min_records: int = MIN_RECO
     try:
         print(f"🧹 Manual cleanup triggered (keep {keep_days} days, min {min_records} records per device)")
         
-        # Calculate cutoff timestamp
-        cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)
-        
         # Get current stats
-        metrics_count = await db[METRICS_COLL].count_documents({})
-        events_count = await db[EVENTS_COLL].count_documents({})
-        
-        # Cleanup metrics
-        devices = await db[METRICS_COLL].distinct("meta.device_id")
-        total_metrics_deleted = 0
+        metrics_count = await estimated_count(METRICS_COLL)
+        events_count = await estimated_count(EVENTS_COLL)
         
-        for device_id in devices:
-            device_metrics_count = await db[METRICS_COLL].count_documents({"meta.device_id": device_id})
-            
-            if device_metrics_count <= min_records:
-                continue
-            
-            # Keep only the most recent records
-            metrics_to_keep = max(min_records, device_metrics_count - 
-                await db[METRICS_COLL].count_documents({
-                    "meta.device_id": device_id,
-                    "ts": {"$lt": cutoff_time}
-                })
-            )
-            
-            if metrics_to_keep < device_metrics_count:
-                # Get the timestamp of the Nth most recent record
-                keep_threshold = await db[METRICS_COLL].find(
-                    {"meta.device_id": device_id}
-                ).sort("ts", -1).skip(metrics_to_keep - 1).limit(1).to_list(1)
-                
-                if keep_threshold:
-                    threshold_time = keep_threshold[0]["ts"]
-                    result = await db[METRICS_COLL].delete_many({
-                        "meta.device_id": device_id,
-                        "ts": {"$lt": threshold_time}
-                    })
-                    total_metrics_deleted += result.deleted_count
-        
-        # Cleanup events
-        events_result = await db[EVENTS_COLL].delete_many({
-            "detected_at": {"$lt": cutoff_time}
-        })
-        events_deleted = events_result.deleted_count
+        result = await enforce_retention(keep_days, min_records)
+        total_metrics_deleted = result["deleted"]["metrics"]
+        events_deleted = result["deleted"]["events"]
+        cutoff_time = result["cutoff_time"]
         
         # Get final stats
-        final_metrics_count = await db[METRICS_COLL].count_documents({})
-        final_events_count = await db[EVENTS_COLL].count_documents({})
+        final_metrics_count = await estimated_count(METRICS_COLL)
+        final_events_count = await estimated_count(EVENTS_COLL)
         
         return {
             "success": True,
@@ -283,68 +1384,68 @@ async def manual_cleanup(keep_days: int = KEEP_DAYS, min_records: int = MIN_RECO
         raise HTTPException(500, f"Cleanup failed: {str(e)}")
 
 @app.get("/admin/stats")
-async def get_database_stats():
-    """Get database statistics"""
+async def get_database_stats(refresh: bool = False):
+    """Get database statistics (metadata-based, cached for STATS_CACHE_SECONDS)"""
     try:
-        metrics_count = await db[METRICS_COLL].count_documents({})
-        events_count = await db[EVENTS_COLL].count_documents({})
-        
-        # Get date range
-        oldest_metric = await db[METRICS_COLL].find_one({}, sort=[("ts", 1)])
-        newest_metric = await db[METRICS_COLL].find_one({}, sort=[("ts", -1)])
-        
-        # Get device count
-        devices = await db[METRICS_COLL].distinct("meta.device_id")
-        
+        stats = await cached_stats(refresh)
         return {
             "success": True,
-            "stats": {
-                "metrics": metrics_count,
-                "events": events_count,
-                "devices": len(devices),
-                "date_range": {
-                    "oldest": oldest_metric["ts"].isoformat() if oldest_metric else None,
-                    "newest": newest_metric["ts"].isoformat() if newest_metric else None
-                }
-            }
+            "cached_at": datetime.datetime.fromtimestamp(stats_cache["at"]).isoformat(),
+            "stats": stats
         }
         
     except Exception as e:
         raise HTTPException(500, f"Failed to get stats: {str(e)}")
 
+@app.get("/internal/metrics", response_class=PlainTextResponse)
+async def internal_metrics():
+    """Backend self-instrumentation in Prometheus text format"""
+    for kind, buffer in write_buffers.items():
+        INSTRUMENTS.set("backend_write_buffer_docs", {"kind": kind}, buffer.snapshot()["queue_depth"])
+    INSTRUMENTS.set("backend_latest_series", {}, latest_values.size())
+    INSTRUMENTS.set("backend_stream_subscribers", {}, len(stream_hub.subscribers))
+    return INSTRUMENTS.render()
+
+@app.get("/admin/ingest-buffer")
+async def get_ingest_buffer_stats():
+    """Queue depth and flush latency of the write buffers"""
+    return {
+        "enabled": bool(write_buffers),
+        "buffers": {kind: buffer.snapshot() for kind, buffer in write_buffers.items()}
+    }
+
 @app.get("/devices/with-interfaces", response_model=List[DeviceOut])
 async def get_devices_with_interfaces(
     office: Optional[str] = Query(None),
     city: Optional[str] = Query(None),
     country: Optional[str] = Query(None)
 ):
-    # Aggregate devices
+    # Indexed lookup on the device inventory
     match = {}
-    if office: match["meta.location"] = office
-    if city: match["meta.city"] = city
-    if country: match["meta.country"] = country
-    devices_cursor = db[METRICS_COLL].aggregate([
-        {"$match": match},
-        {"$group": {
-            "_id": "$meta.device_id",
-            "hostid": {"$first": "$meta.hostid"},
-            "interfaces": {"$addToSet": {
-                "name": "$meta.ifdescr",
-                "ifindex": "$meta.ifindex",
-                "status": "$value.status" if "$value.status" else None,
-                "connected_to": "$meta.connected_to" if "$meta.connected_to" else None,
-                "connected_interface": "$meta.connected_interface" if "$meta.connected_interface" else None
-            }}
-        }}
-    ])
-    devices = []
-    async for d in devices_cursor:
-        device = DeviceOut(
-            device_id=d["_id"],
-            hostid=d.get("hostid"),
-            interfaces=[InterfaceOut(**iface) for iface in d.get("interfaces", [])],
-            connections=[] # Optionally fill with inferred connections
-        )
-        # Optionally, infer connections here based on interface data
-        devices.append(device)
-    return devices
+    if office: match["location"] = office
+    if city: match["city"] = city
+    if country: match["country"] = country
+    cursor = db[DEVICES_COLL].find(match, {"_id": 0}).sort([("device_id", 1), ("ifindex", 1)])
+    with INSTRUMENTS.mongo_op("find", DEVICES_COLL):
+        rows = await cursor.to_list(None)
+    devices: Dict[str, DeviceOut] = {}
+    for d in rows:
+        device = devices.get(d["device_id"])
+        if device is None:
+            device = devices[d["device_id"]] = DeviceOut(
+                device_id=d["device_id"],
+                hostid=d.get("hostid"),
+                interfaces=[],
+                connections=[] # Optionally fill with inferred connections
+            )
+        if d.get("ifindex") is None:
+            continue
+        device.interfaces.append(InterfaceOut(
+            name=d.get("ifdescr") or str(d["ifindex"]),
+            ifindex=_ifindex_int(d["ifindex"]),
+            ifdescr=d.get("ifdescr"),
+            connected_to=d.get("connected_to"),
+            connected_interface=d.get("connected_interface")
+        ))
+    # Optionally, infer connections here based on interface data
+    return list(devices.values())